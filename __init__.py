@@ -14,50 +14,12 @@ import bpy
 from bpy.types import Context, Menu, Panel, Operator
 from bpy_extras.io_utils import ImportHelper, ExportHelper
 
-import os
-import platform
-import numpy as np
-import logging
-logger = logging.getLogger("fbxskel_tools")
-logger.propagate = False
-import sys
-
+# Only the operator and menu classes are loaded with the addon, the parser, writer, NumPy and the
+# logging setup are imported the first time an operator runs
 from .fbxskel.ui import FBXSKEL_ImportFbxskel
 from .fbxskel.ui import FBXSKEL_ExportFbxskel
-
-class ColoredFormatter(logging.Formatter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # ANSI Coloring
-        grey = "\x1b[38;20m"
-        yellow = "\x1b[33;20m"
-        red = "\x1b[31;20m"
-        bold_red = "\x1b[31;1m"
-        _reset = "\x1b[0m"
-        self.FORMATS = {
-            logging.DEBUG: f"{grey}{self._fmt}{_reset}",
-            logging.INFO: f"{grey}{self._fmt}{_reset}",
-            logging.WARNING: f"{yellow}{self._fmt}{_reset}",
-            logging.ERROR: f"{red}{self._fmt}{_reset}",
-            logging.CRITICAL: f"{bold_red}{self._fmt}{_reset}"
-        }
-
-    def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
-
-handler = logging.StreamHandler(sys.stdout)
-formatter = logging.Formatter('%(levelname)s | %(message)s')
-colored_formatter = formatter
-is_windows = platform.system() == "Windows"
-if not (is_windows and int(platform.release()) < 10):
-    if is_windows:
-        os.system("color")
-    colored_formatter = ColoredFormatter('%(levelname)s | %(message)s')
-handler.setFormatter(colored_formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+from .fbxskel.ui import FBXSKEL_ExportFbxskelBatch
+from .fbxskel.ui import FBXSKEL_WatchFbxskel, StopWatch
 
 class FBXSKEL_CustomAddonPreferences(bpy.types.AddonPreferences):
     bl_idname = __name__
@@ -70,11 +32,48 @@ class FBXSKEL_CustomAddonPreferences(bpy.types.AddonPreferences):
                  ('ERROR','ERROR','','',3)],
         default = 'INFO'
     )
+
+    use_cache: bpy.props.BoolProperty(
+        name="Cache parsed skeletons",
+        description="Keep parsed fbxskel files in memory so re-importing an unchanged file skips parsing",
+        default = True
+    )
+
+    cache_size: bpy.props.IntProperty(
+        name="Cache size (MB)",
+        default = 256,
+        min = 1
+    )
+
+    cache_dir: bpy.props.StringProperty(
+        name="Disk cache directory",
+        description="If set, parsed skeletons are also cached as .npz files in this directory",
+        subtype='DIR_PATH',
+        default = ""
+    )
+
+    profile_next_run: bpy.props.BoolProperty(
+        name="Profile next import/export",
+        description="Capture the next operator run with cProfile into a .prof file, then switch back off",
+        default = False
+    )
+
+    profile_dir: bpy.props.StringProperty(
+        name="Profile directory",
+        description="Where .prof files are written (default: Blender's temporary directory)",
+        subtype='DIR_PATH',
+        default = ""
+    )
     
     def draw(self, context):
         layout = self.layout
         
         layout.prop(self, "logging_level")
+        layout.prop(self, "use_cache")
+        layout.prop(self, "cache_size")
+        layout.prop(self, "cache_dir")
+        layout.prop(self, "profile_next_run")
+        layout.prop(self, "profile_dir")
 
 
 class FBXSKEL_export_menu(bpy.types.Menu):
@@ -83,6 +82,7 @@ class FBXSKEL_export_menu(bpy.types.Menu):
 
     def draw(self, context):
         self.layout.operator(FBXSKEL_ExportFbxskel.bl_idname, text="WILDS skeleton files (.fbxskel.7)", icon="ARMATURE_DATA")
+        self.layout.operator(FBXSKEL_ExportFbxskelBatch.bl_idname, text="WILDS skeleton files, one per armature (.fbxskel.7)", icon="ARMATURE_DATA")
 
 def FBXSKEL_menu_func_export(self, context):
     self.layout.menu(FBXSKEL_export_menu.bl_idname)
@@ -93,26 +93,32 @@ class FBXSKEL_import_menu(bpy.types.Menu):
 
     def draw(self, context):
         self.layout.operator(FBXSKEL_ImportFbxskel.bl_idname, text="WILDS skeleton files (.fbxskel.7)", icon="ARMATURE_DATA")
+        self.layout.operator(FBXSKEL_WatchFbxskel.bl_idname, text="Watch imported skeleton files (toggle)", icon="FILE_REFRESH")
 
 def FBXSKEL_menu_func_import(self, context):
     self.layout.menu(FBXSKEL_import_menu.bl_idname)
 
 def register():
     bpy.utils.register_class(FBXSKEL_ImportFbxskel)
+    bpy.utils.register_class(FBXSKEL_WatchFbxskel)
     bpy.utils.register_class(FBXSKEL_CustomAddonPreferences)
     bpy.utils.register_class(FBXSKEL_import_menu)
     bpy.types.TOPBAR_MT_file_import.append(FBXSKEL_menu_func_import)
     bpy.utils.register_class(FBXSKEL_ExportFbxskel)
+    bpy.utils.register_class(FBXSKEL_ExportFbxskelBatch)
     bpy.utils.register_class(FBXSKEL_export_menu)
     bpy.types.TOPBAR_MT_file_export.append(FBXSKEL_menu_func_export)
     pass
 
 def unregister():
+    StopWatch()
     bpy.utils.unregister_class(FBXSKEL_ImportFbxskel)
+    bpy.utils.unregister_class(FBXSKEL_WatchFbxskel)
     bpy.utils.unregister_class(FBXSKEL_CustomAddonPreferences)
     bpy.utils.unregister_class(FBXSKEL_import_menu)
     bpy.types.TOPBAR_MT_file_import.remove(FBXSKEL_menu_func_import)
     bpy.utils.unregister_class(FBXSKEL_ExportFbxskel)
+    bpy.utils.unregister_class(FBXSKEL_ExportFbxskelBatch)
     bpy.utils.unregister_class(FBXSKEL_export_menu)
     bpy.types.TOPBAR_MT_file_export.remove(FBXSKEL_menu_func_export)
     pass
@@ -0,0 +1,5 @@
+import sys
+
+from .fbxskel_cli import main
+
+sys.exit(main())
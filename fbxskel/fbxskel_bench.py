@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+
+from .fbxskel_parser import FbxskelParser, MAX_BONE_COUNT
+from .fbxskel_writer import write_fbxskel, bone_infos_from_parsed
+from .fbxskel_hash import murmurhash_32, murmurhash_32_batch, clear_name_hash_cache
+
+# The largest size is the most bones a file can hold
+DEFAULT_SIZES = [10, 100, 1000, 10000, MAX_BONE_COUNT]
+
+# Everything that can be imported outside of Blender
+BPY_FREE_MODULES = ["fbxskel_timing", "fbxskel_logging", "fbxskel_hash", "fbxskel_parser", "fbxskel_math", "fbxskel_skeleton",
+                    "fbxskel_writer", "fbxskel_cache", "fbxskel_index", "fbxskel_diff", "fbxskel_validate", "fbxskel_cli"]
+
+NAME_SIDES = ["", "L_", "R_", "C_"]
+NAME_PARTS = ["root", "Hip", "Spine", "Neck", "Head", "Shoulder", "UpperArm", "Forearm", "Hand", "Thumb", "Index",
+              "Middle", "Ring", "Pinky", "Thigh", "Knee", "Foot", "Toe", "Tail", "Wing", "Jaw", "Eye", "Cloth", "Hair"]
+NAME_SUFFIXES = ["", "_Twist", "_Helper", "_Sub", "_End", "_Null"]
+
+def make_synthetic_skeleton(bone_count, seed=0, max_depth=32):
+    # Writer-ready bone columns: game-like names, a single root, chains of bounded depth
+    if not 0 <= bone_count <= MAX_BONE_COUNT:
+        raise RuntimeError("Can't generate " + str(bone_count) + " bones, a skeleton holds at most " + str(MAX_BONE_COUNT))
+    rnd = random.Random(seed)
+    names = []
+    used_names = set()
+    parents = np.full(bone_count, -1, dtype=np.int64)
+    depths = np.zeros(bone_count, dtype=np.int64)
+    for bone_i in range(bone_count):
+        name = rnd.choice(NAME_SIDES) + rnd.choice(NAME_PARTS) + rnd.choice(NAME_SUFFIXES) + "_" + str(rnd.randint(0, 99))
+        while name in used_names:
+            name += "_" + str(rnd.randint(0, 9))
+        used_names.add(name)
+        names.append(name)
+        if bone_i == 0:
+            continue
+        # Mostly continue the previous chain, sometimes branch off an earlier bone
+        parent_i = bone_i - 1 if rnd.random() < 0.7 else rnd.randrange(bone_i)
+        while depths[parent_i] >= max_depth - 1:
+            parent_i = parents[parent_i]
+        parents[bone_i] = parent_i
+        depths[bone_i] = depths[parent_i] + 1
+    if bone_count > 0:
+        names[0] = "root"
+
+    rng = np.random.default_rng(seed)
+    quats = rng.normal(size=(bone_count, 4))
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    bone_columns = {}
+    bone_columns["name"] = names
+    bone_columns["index"] = np.arange(bone_count)
+    bone_columns["id"] = rng.integers(0, 65536, size=bone_count, dtype=np.uint16)
+    bone_columns["parent_id"] = parents
+    bone_columns["loc"] = rng.uniform(-0.5, 0.5, size=(bone_count, 3))
+    bone_columns["rot"] = quats
+    bone_columns["scl"] = np.ones((bone_count, 3))
+    return bone_columns
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_size(bone_count, repeat, temp_dir, pure_hash_limit):
+    bone_columns = make_synthetic_skeleton(bone_count)
+    data, _ = write_fbxskel(bone_columns)
+    path = os.path.join(temp_dir, "synthetic_" + str(bone_count) + ".fbxskel.7")
+    with open(path, "wb") as file_out:
+        file_out.write(data)
+    encoded_names = [name.encode("utf-16LE") for name in bone_columns["name"]]
+    with FbxskelParser(path=path) as parser:
+        parsed_count = len(parser.read())
+    if parsed_count != bone_count:
+        raise RuntimeError("Wrote " + str(bone_count) + " bones but parsed back " + str(parsed_count))
+
+    def parse():
+        with FbxskelParser(path=path) as parser:
+            return parser.read()
+
+    def write():
+        clear_name_hash_cache()
+        return write_fbxskel(bone_columns)
+
+    def hash_pure():
+        return [murmurhash_32(encoded_name, 0xFFFFFFFF) for encoded_name in encoded_names]
+
+    def hash_batch():
+        return murmurhash_32_batch(encoded_names, 0xFFFFFFFF)
+
+    def round_trip():
+        clear_name_hash_cache()
+        with FbxskelParser(path=path) as parser:
+            bone_infos = parser.read()
+        return write_fbxskel(bone_infos_from_parsed(bone_infos))
+
+    cases = {
+        "parse": parse,
+        "write": write,
+        "hash_batch": hash_batch,
+        "round_trip": round_trip,
+    }
+    # The pure python hash is slow enough to dominate the run on huge skeletons
+    if bone_count <= pure_hash_limit:
+        cases["hash_pure"] = hash_pure
+
+    results = {}
+    for case_name, function in cases.items():
+        seconds = best_time(function, repeat)
+        results[case_name] = {
+            "seconds": seconds,
+            "bones_per_second": parsed_count / seconds if seconds > 0 else None,
+            "mb_per_second": len(data) / (1024 * 1024) / seconds if seconds > 0 else None,
+            "peak_memory_bytes": peak_memory(function),
+        }
+    return {"bone_count": parsed_count, "file_size": len(data), "results": results}
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, pure_hash_limit=10000):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        runs = [bench_size(bone_count, repeat, temp_dir, pure_hash_limit) for bone_count in sizes]
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": repeat,
+        "runs": runs,
+    }
+
+def import_time(module, top=10):
+    # -X importtime of a single module in a fresh interpreter, so nothing it needs is already loaded.
+    # Times are in microseconds, the "heaviest" entries are the modules it pulled in, by self time
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    package = os.path.basename(package_dir)
+    target = package + "." + module
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(package_dir) + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + target], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("Importing " + target + " failed: " + (result.stderr.strip().splitlines() or [""])[-1])
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        entries.append({"module": name.strip(), "depth": len(name) - len(name.lstrip()) - 1, "self_us": int(fields[0]), "cumulative_us": int(fields[1])})
+    # The output is in post-order: the modules target pulled in are the nested entries right before it
+    target_i = next(entry_i for entry_i, entry in enumerate(entries) if entry["module"] == target and entry["depth"] == 0)
+    first_i = target_i
+    while first_i > 0 and entries[first_i - 1]["depth"] > 0:
+        first_i -= 1
+    imported = entries[first_i:target_i + 1]
+    return {
+        "module": target,
+        "cumulative_us": entries[target_i]["cumulative_us"],
+        "modules_loaded": len(imported),
+        "loads_numpy": any(entry["module"] == "numpy" for entry in imported),
+        "heaviest": [{"module": entry["module"], "self_us": entry["self_us"], "cumulative_us": entry["cumulative_us"]}
+                     for entry in sorted(imported, key=lambda entry: entry["self_us"], reverse=True)[:top]],
+    }
+
+def import_times(modules=BPY_FREE_MODULES, repeat=3):
+    # Best of repeat runs per module, the first one also warms up the disk cache for the others
+    runs = []
+    for module in modules:
+        results = [import_time(module) for _ in range(repeat)]
+        runs.append(min(results, key=lambda result: result["cumulative_us"]))
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": repeat,
+        "runs": runs,
+    }
+
+def write_report(report, output):
+    text = json.dumps(report, indent="\t")
+    if output is None:
+        print(text)
+    else:
+        with open(output, "w") as file_out:
+            file_out.write(text)
+
+def importtime_main(modules=BPY_FREE_MODULES, repeat=3, output=None):
+    write_report(import_times(modules=modules, repeat=repeat), output)
+    return 0
+
+def main(sizes=DEFAULT_SIZES, repeat=3, output=None, pure_hash_limit=10000):
+    write_report(run_benchmarks(sizes=sizes, repeat=repeat, pure_hash_limit=pure_hash_limit), output)
+    return 0
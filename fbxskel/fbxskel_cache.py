@@ -0,0 +1,140 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import logging
+logger = logging.getLogger("fbxskel_tools")
+
+from .fbxskel_parser import FbxskelParser, BONE_DTYPE, bone_table_to_infos
+
+DISK_CACHE_VERSION = 1
+
+def cache_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+class SkeletonCache():
+    # Parsed bone tables, keyed by (absolute path, mtime, size) so an edited file is never served stale
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        key = cache_key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            logger.debug("Skeleton cache hit for " + key[0])
+            return self.build_bone_infos(entry)
+
+        entry = self.read_disk(key)
+        if entry is not None:
+            with self.lock:
+                self.disk_hits += 1
+            logger.debug("Skeleton disk cache hit for " + key[0])
+            self.store(key, entry)
+            return self.build_bone_infos(entry)
+
+        with FbxskelParser(path=path) as parser:
+            bone_infos = parser.read()
+        entry = (parser.bone_table, [bone_info["name"] for bone_info in bone_infos])
+        with self.lock:
+            self.misses += 1
+        logger.debug("Skeleton cache miss for " + key[0])
+        self.store(key, entry)
+        self.write_disk(key, entry)
+        return bone_infos
+
+    def build_bone_infos(self, entry):
+        bone_table, names = entry
+        bone_infos = bone_table_to_infos(bone_table)
+        for bone_info, name in zip(bone_infos, names):
+            bone_info["name"] = name
+        return bone_infos
+
+    def entry_size(self, entry):
+        bone_table, names = entry
+        # Rough footprint of the names list: object header plus two bytes per character
+        return bone_table.nbytes + sum(64 + 2 * len(name) for name in names)
+
+    def store(self, key, entry):
+        size = self.entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.entry_size(evicted)
+
+    def disk_path(self, key):
+        digest = hashlib.sha1(key[0].encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".npz")
+
+    def read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        disk_path = self.disk_path(key)
+        if not os.path.isfile(disk_path):
+            return None
+        try:
+            with np.load(disk_path, allow_pickle=False) as npz:
+                if int(npz["version"]) != DISK_CACHE_VERSION or str(npz["path"]) != key[0] or int(npz["mtime"]) != key[1] or int(npz["size"]) != key[2]:
+                    return None
+                bone_table = npz["bone_table"]
+                if bone_table.dtype != BONE_DTYPE:
+                    return None
+                names = npz["names"].tolist()
+            return (bone_table, names)
+        except Exception as e:
+            logger.warning("Ignoring unreadable skeleton cache file " + disk_path + ", reason = " + str(e))
+            return None
+
+    def write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        bone_table, names = entry
+        disk_path = self.disk_path(key)
+        temp_path = disk_path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, "wb") as file_out:
+                np.savez(
+                    file_out,
+                    version=np.array(DISK_CACHE_VERSION),
+                    path=np.array(key[0]),
+                    mtime=np.array(key[1], dtype=np.int64),
+                    size=np.array(key[2], dtype=np.int64),
+                    bone_table=bone_table,
+                    names=np.array(names, dtype=str),
+                )
+            os.replace(temp_path, disk_path)
+        except Exception as e:
+            logger.warning("Could not write skeleton cache file " + disk_path + ", reason = " + str(e))
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def log_stats(self):
+        logger.info("Skeleton cache: " + str(self.hits) + " hits, " + str(self.disk_hits) + " disk hits, " + str(self.misses) + " misses, " + str(len(self.entries)) + " entries (" + str(round(self.size / (1024 * 1024), 2)) + " MB)")
+
+skeleton_cache = SkeletonCache()
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import sys
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_parser import FbxskelParser
+from .fbxskel_writer import write_fbxskel, save_fbxskel, bone_infos_from_parsed
+from .fbxskel_validate import validate_fbxskel
+from .fbxskel_diff import diff_files, merge_files, diff_is_empty, format_diff
+
+FBXSKEL_EXT = ".fbxskel.7"
+DUMP_EXTS = [".json", ".npz"]
+
+def collect_files(paths, extensions):
+    # Returns (file, root) pairs, root being the directory the file was found from
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if any(filename.lower().endswith(ext) for ext in extensions):
+                        files.append((os.path.join(dirpath, filename), path))
+        else:
+            files.append((path, os.path.dirname(path)))
+    return files
+
+def output_path(path, root, output_dir, new_name):
+    if output_dir is None:
+        return os.path.join(os.path.dirname(path), new_name)
+    relative_dir = os.path.relpath(os.path.dirname(path), root)
+    return os.path.normpath(os.path.join(output_dir, relative_dir, new_name))
+
+def read_fbxskel(path):
+    with FbxskelParser(path=path) as parser:
+        bone_infos = parser.read()
+    return bone_infos
+
+def save_dump(bone_infos, path):
+    if path.lower().endswith(".npz"):
+        np.savez(
+            path,
+            name=np.array([bone_info["name"] for bone_info in bone_infos], dtype=str),
+            name_hash=np.array([bone_info["name_hash"] for bone_info in bone_infos], dtype=np.uint32),
+            parent=np.array([bone_info["parent"] for bone_info in bone_infos], dtype=np.int16),
+            id=np.array([bone_info["id"] for bone_info in bone_infos], dtype=np.uint16),
+            rot_quat=np.array([bone_info["rot_quat"] for bone_info in bone_infos], dtype=np.float32).reshape(-1, 4),
+            loc=np.array([bone_info["loc"] for bone_info in bone_infos], dtype=np.float32).reshape(-1, 3),
+            scl=np.array([bone_info["scl"] for bone_info in bone_infos], dtype=np.float32).reshape(-1, 3),
+        )
+    else:
+        with open(path, "w", encoding="utf-8") as file_out:
+            json.dump(bone_infos, file_out, indent="\t", ensure_ascii=False)
+
+def load_dump(path):
+    if path.lower().endswith(".npz"):
+        with np.load(path, allow_pickle=False) as npz:
+            columns = {key: npz[key].tolist() for key in ["name", "parent", "id", "rot_quat", "loc", "scl"]}
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+    with open(path, "r", encoding="utf-8") as file_in:
+        return json.load(file_in)
+
+def compare_bone_infos(bone_infos, other_bone_infos):
+    if len(bone_infos) != len(other_bone_infos):
+        return ["bone count changed from " + str(len(bone_infos)) + " to " + str(len(other_bone_infos))]
+    issues = []
+    for bone_i, (bone_info, other_bone_info) in enumerate(zip(bone_infos, other_bone_infos)):
+        for key in ["name", "name_hash", "parent", "id", "rot_quat", "loc", "scl"]:
+            if bone_info[key] != other_bone_info[key]:
+                issues.append("bone " + str(bone_i) + " " + key + " changed from " + str(bone_info[key]) + " to " + str(other_bone_info[key]))
+    return issues
+
+def base_path(path, root, base):
+    # The counterpart of path in base, base being either a file or a tree laid out like root
+    if os.path.isdir(base):
+        return os.path.join(base, os.path.relpath(path, root))
+    return base
+
+def run_task(task):
+    command, path, root, options = task
+    try:
+        if command == "dump":
+            bone_infos = read_fbxskel(path)
+            out_path = output_path(path, root, options["output_dir"], os.path.basename(path) + "." + options["format"])
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+            save_dump(bone_infos, out_path)
+            return path, True, str(len(bone_infos)) + " bones -> " + out_path
+        elif command == "pack":
+            bone_infos = load_dump(path)
+            new_name = os.path.basename(path)
+            for ext in DUMP_EXTS:
+                if new_name.lower().endswith(ext):
+                    new_name = new_name[:-len(ext)]
+            if not new_name.lower().endswith(FBXSKEL_EXT):
+                new_name += FBXSKEL_EXT
+            out_path = output_path(path, root, options["output_dir"], new_name)
+            data, beware = write_fbxskel(bone_infos_from_parsed(bone_infos))
+            written = save_fbxskel(out_path, data)
+            return path, not beware, str(len(bone_infos)) + " bones -> " + out_path + ("" if written else " (unchanged)")
+        elif command == "info":
+            # Header and parent column only, plus the names of the root bones
+            with FbxskelParser(path=path, positioned=True) as parser:
+                columns = parser.read_columns(["parent", "name_offset"])
+                root_names = []
+                for name_offset in columns["name_offset"][columns["parent"] == -1].tolist():
+                    parser.bs.seek(name_offset)
+                    root_names.append(parser.bs.readStringUTF())
+            return path, True, str(parser.bone_count) + " bones, roots: " + ", ".join(root_names)
+        elif command == "roundtrip":
+            bone_infos = read_fbxskel(path)
+            data, beware = write_fbxskel(bone_infos_from_parsed(bone_infos))
+            with FbxskelParser(path=path, data=data) as parser:
+                issues = compare_bone_infos(bone_infos, parser.read())
+            if issues:
+                return path, False, "; ".join(issues)
+            return path, True, str(len(bone_infos)) + " bones, round trip ok"
+        elif command == "diff":
+            other_path = base_path(path, root, options["base"])
+            if not os.path.isfile(other_path):
+                return path, False, "no counterpart in the base (" + other_path + ")"
+            diff = diff_files(other_path, path, options["tolerance"])
+            return path, diff_is_empty(diff), format_diff(diff)
+        elif command == "merge":
+            other_path = base_path(path, root, options["base"])
+            out_path = output_path(path, root, options["output_dir"], os.path.basename(path))
+            merged, written = merge_files(other_path, path, out_path, options["overwrite"])
+            return path, True, str(len(merged)) + " bones -> " + out_path + ("" if written else " (unchanged)")
+        raise RuntimeError("Unknown command " + str(command))
+    except Exception as e:
+        return path, False, str(e)
+
+def validate_task(task):
+    # Also hands back the structured report, for --report
+    _, path, _, _ = task
+    report = validate_fbxskel(path)
+    if not report["ok"]:
+        return path, False, "; ".join(issue["message"] for issue in report["issues"]), report
+    return path, True, str(report["bone_count"]) + " bones, ok", report
+
+def run_tasks(tasks, jobs, function=run_task):
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(task)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Thousands of small files: hand them out in chunks to keep the IPC overhead low
+            chunksize = max(1, min(64, len(tasks) // (jobs * 4)))
+            yield from executor.map(function, tasks, chunksize=chunksize)
+
+def database_main(args):
+    from .fbxskel_db import BoneDatabase
+    if args.command == "query" and not os.path.isfile(args.db):
+        print(args.db + " not found, build it with the index command first", file=sys.stderr)
+        return 1
+    with BoneDatabase(args.db) as database:
+        if args.command == "index":
+            stats = database.scan(args.paths, jobs=max(1, args.jobs))
+            for path, error in stats["failed"]:
+                print("FAIL " + path + ": " + error)
+            print(str(stats["scanned"]) + " files scanned, " + str(stats["unchanged"]) + " unchanged, " + str(stats["removed"]) + " removed, " + str(len(stats["failed"])) + " failed", file=sys.stderr)
+            return 1 if stats["failed"] else 0
+        if args.bone is not None:
+            rows = database.files_with_bone(args.bone)
+        elif args.id is not None:
+            rows = database.files_with_id(args.id)
+        elif args.same_hierarchy is not None:
+            rows = [(path,) for path in database.same_hierarchy(args.same_hierarchy)]
+        elif args.hierarchy_groups:
+            rows = [(len(group),) + tuple(group) for group in database.hierarchy_groups()]
+        elif args.bones is not None:
+            rows = [tuple(bone.values()) for bone in database.bones_of(args.bones)]
+        else:
+            rows = list(database.summary().items())
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+    return 0
+
+def main(argv=None):
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument("paths", nargs="+", help="files or directories to scan")
+    common_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: all cores)")
+    common_parser.add_argument("-q", "--quiet", action="store_true", help="only report failures")
+
+    arg_parser = argparse.ArgumentParser(prog="python -m fbxskel", description="Inspect and convert MHWilds skeleton files (.fbxskel.7) without Blender.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = subparsers.add_parser("dump", parents=[common_parser], help="convert .fbxskel.7 files to JSON or NPZ")
+    dump_parser.add_argument("-f", "--format", choices=["json", "npz"], default="json")
+    dump_parser.add_argument("-o", "--output-dir", default=None, help="write outputs here, mirroring the input tree (default: next to the inputs)")
+
+    pack_parser = subparsers.add_parser("pack", parents=[common_parser], help="convert JSON or NPZ dumps back to .fbxskel.7 files")
+    pack_parser.add_argument("-o", "--output-dir", default=None, help="write outputs here, mirroring the input tree (default: next to the inputs)")
+
+    subparsers.add_parser("info", parents=[common_parser], help="list bone counts and root bones, reading as little as possible")
+
+    validate_parser = subparsers.add_parser("validate", parents=[common_parser], help="check .fbxskel.7 files for broken hierarchies, transforms, names and hash tables")
+    validate_parser.add_argument("--report", default=None, help="also write the per-file reports here as JSON")
+
+    subparsers.add_parser("roundtrip", parents=[common_parser], help="check that .fbxskel.7 files survive a parse/write/parse cycle")
+
+    diff_parser = subparsers.add_parser("diff", parents=[common_parser], help="compare .fbxskel.7 files against their counterparts in a base file or tree")
+    diff_parser.add_argument("-b", "--base", required=True, help="base .fbxskel.7 file, or a tree laid out like the scanned directories (e.g. the vanilla extract)")
+    diff_parser.add_argument("--tolerance", type=float, default=1e-4, help="transform differences below this are ignored")
+
+    merge_parser = subparsers.add_parser("merge", parents=[common_parser], help="add the bones of .fbxskel.7 files that their base counterparts don't have")
+    merge_parser.add_argument("-b", "--base", required=True, help="base .fbxskel.7 file, or a tree laid out like the scanned directories")
+    merge_parser.add_argument("-o", "--output-dir", required=True, help="write the merged files here, mirroring the input tree")
+    merge_parser.add_argument("--overwrite", action="store_true", help="bones found in both also take the transforms and ids of the scanned files")
+
+    bench_parser = subparsers.add_parser("bench", help="time the parser, writer and hashing on synthetic skeletons, report as JSON")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=None, help="bone counts to generate, at most 32767 (default: 10 to 32767)")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="keep the best of this many runs")
+    bench_parser.add_argument("-o", "--output", default=None, help="write the JSON report here instead of stdout")
+
+    index_parser = subparsers.add_parser("index", help="record the bones of every .fbxskel.7 file in a SQLite database, re-parsing only changed files")
+    index_parser.add_argument("paths", nargs="+", help="files or directories to scan")
+    index_parser.add_argument("--db", required=True, help="SQLite database to create or update")
+    index_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: all cores)")
+
+    query_parser = subparsers.add_parser("query", help="query a database built by the index command")
+    query_parser.add_argument("--db", required=True, help="SQLite database built by the index command")
+    query_group = query_parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("--bone", help="files containing a bone with this name")
+    query_group.add_argument("--id", type=int, help="files containing a bone with this mhws_skel_id")
+    query_group.add_argument("--same-hierarchy", metavar="FILE", help="files with the same bone names and parents as FILE")
+    query_group.add_argument("--hierarchy-groups", action="store_true", help="groups of files sharing a hierarchy")
+    query_group.add_argument("--bones", metavar="FILE", help="the bones of FILE")
+    query_group.add_argument("--summary", action="store_true", help="file, bone and distinct name counts")
+
+    importtime_parser = subparsers.add_parser("importtime", help="measure the import time of the modules usable without Blender, report as JSON")
+    importtime_parser.add_argument("--modules", nargs="+", default=None, help="module names, e.g. fbxskel_parser (default: all of them)")
+    importtime_parser.add_argument("--repeat", type=int, default=3, help="keep the best of this many runs")
+    importtime_parser.add_argument("-o", "--output", default=None, help="write the JSON report here instead of stdout")
+
+    args = arg_parser.parse_args(argv)
+    if args.command == "bench":
+        from .fbxskel_bench import main as bench_main, DEFAULT_SIZES
+        return bench_main(sizes=args.sizes or DEFAULT_SIZES, repeat=args.repeat, output=args.output)
+    if args.command in ["index", "query"]:
+        logging.basicConfig(format="%(levelname)s | %(message)s", level=logging.WARNING)
+        return database_main(args)
+    if args.command == "importtime":
+        from .fbxskel_bench import importtime_main, BPY_FREE_MODULES
+        return importtime_main(modules=args.modules or BPY_FREE_MODULES, repeat=args.repeat, output=args.output)
+    logging.basicConfig(format="%(levelname)s | %(message)s", level=logging.WARNING)
+
+    options = {
+        "output_dir": getattr(args, "output_dir", None),
+        "format": getattr(args, "format", None),
+        "base": getattr(args, "base", None),
+        "tolerance": getattr(args, "tolerance", None),
+        "overwrite": getattr(args, "overwrite", False),
+    }
+    extensions = [FBXSKEL_EXT + ext for ext in DUMP_EXTS] if args.command == "pack" else [FBXSKEL_EXT]
+    tasks = [(args.command, path, root, options) for path, root in collect_files(args.paths, extensions)]
+
+    failures = 0
+    reports = []
+    function = validate_task if args.command == "validate" else run_task
+    for result in run_tasks(tasks, max(1, args.jobs), function):
+        path, ok, message = result[:3]
+        reports.extend(result[3:])
+        if not ok:
+            failures += 1
+            print(("DIFF " if args.command == "diff" else "FAIL ") + path + ": " + message)
+        elif not args.quiet:
+            print("OK   " + path + ": " + message)
+    print(str(len(tasks)) + " files, " + str(failures) + " failed", file=sys.stderr)
+    if getattr(args, "report", None):
+        with open(args.report, "w", encoding="utf-8") as file_out:
+            json.dump(reports, file_out, indent="\t", ensure_ascii=False)
+    return 1 if failures else 0
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import logging
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_parser import FbxskelParser
+from .fbxskel_hash import hash_bone_names
+
+DB_SCHEMA_VERSION = 1
+FBXSKEL_EXT = ".fbxskel.7"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    hierarchy_hash TEXT NOT NULL,
+    bone_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bones (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    bone_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_hash INTEGER NOT NULL,
+    bone_id INTEGER NOT NULL,
+    parent INTEGER NOT NULL,
+    PRIMARY KEY (file_id, bone_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bones_name_hash ON bones(name_hash);
+CREATE INDEX IF NOT EXISTS bones_bone_id ON bones(bone_id);
+CREATE INDEX IF NOT EXISTS files_hierarchy_hash ON files(hierarchy_hash);
+CREATE INDEX IF NOT EXISTS files_content_hash ON files(content_hash);
+"""
+
+def hierarchy_hash(names, parents):
+    # Same names in the same order with the same parents, transforms and ids aside
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\x00".join(names).encode("utf-8", "surrogatepass"))
+    digest.update(np.asarray(parents, dtype="<i2").tobytes())
+    return digest.hexdigest()
+
+def scan_file(path):
+    # Runs in the worker processes: everything the database needs from one file, or the error
+    try:
+        with open(path, "rb") as file_in:
+            data = file_in.read()
+        with FbxskelParser(path=path, data=data) as parser:
+            bone_table = parser.read_bone_table()
+            names = parser.bs.readStringsUTF(bone_table["name_offset"])
+            parents = bone_table["parent"].tolist()
+            ids = bone_table["id"].tolist()
+        # Hashes of the names rather than the stored ones, so a file with a broken name hash can't hide a bone
+        name_hashes = np.asarray(hash_bone_names(names), dtype=np.int64).tolist()
+        content_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+        return path, None, (content_hash, hierarchy_hash(names, parents), names, name_hashes, ids, parents)
+    except Exception as e:
+        return path, str(e), None
+
+def collect_fbxskel_files(roots):
+    # (absolute path, mtime_ns, size) of every .fbxskel.7 under roots
+    found = []
+    for root in roots:
+        if os.path.isfile(root):
+            paths = [root]
+        else:
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames) if filename.lower().endswith(FBXSKEL_EXT))
+        for path in paths:
+            stat = os.stat(path)
+            found.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return found
+
+class BoneDatabase():
+    # Bone names, hashes, ids and parents of a whole extract in SQLite. Files are keyed by absolute path and
+    # only re-parsed when their mtime or size changed since the last scan
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        version = None
+        if self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone():
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            version = None if row is None else int(row[0])
+        if version is not None and version != DB_SCHEMA_VERSION:
+            raise RuntimeError(db_path + " uses schema version " + str(version) + ", expected " + str(DB_SCHEMA_VERSION) + ": delete it and scan again")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(DB_SCHEMA_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def scan(self, roots, jobs=None):
+        # Returns {"scanned", "unchanged", "removed", "failed": [(path, error)]}
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        found = collect_fbxskel_files(roots)
+        known = {path: (file_id, mtime_ns, size) for file_id, path, mtime_ns, size in self.connection.execute("SELECT id, path, mtime_ns, size FROM files")}
+        stats = {path: (mtime_ns, size) for path, mtime_ns, size in found}
+        to_scan = [path for path, (mtime_ns, size) in stats.items() if known.get(path, (None, None, None))[1:] != (mtime_ns, size)]
+
+        # Files that disappeared from the scanned roots
+        prefixes = tuple(os.path.join(os.path.abspath(root), "") for root in roots if not os.path.isfile(root))
+        removed = [known[path][0] for path in known if path not in stats and path.startswith(prefixes)]
+
+        failed = []
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE id = ?", [(file_id,) for file_id in removed])
+            for path, error, result in self.run_scan(to_scan, jobs):
+                if error is not None:
+                    failed.append((path, error))
+                    logger.warning("Could not index " + path + ", reason = " + error)
+                    continue
+                self.store(path, stats[path], result)
+        return {"scanned": len(to_scan) - len(failed), "unchanged": len(stats) - len(to_scan), "removed": len(removed), "failed": failed}
+
+    def run_scan(self, paths, jobs):
+        if jobs == 1 or len(paths) <= 1:
+            for path in paths:
+                yield scan_file(path)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                chunksize = max(1, min(64, len(paths) // (jobs * 4)))
+                yield from executor.map(scan_file, paths, chunksize=chunksize)
+
+    def store(self, path, stat, result):
+        content_hash, file_hierarchy_hash, names, name_hashes, ids, parents = result
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        cursor = self.connection.execute(
+            "INSERT INTO files (path, mtime_ns, size, content_hash, hierarchy_hash, bone_count) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat[0], stat[1], content_hash, file_hierarchy_hash, len(names)))
+        file_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO bones (file_id, bone_index, name, name_hash, bone_id, parent) VALUES (?, ?, ?, ?, ?, ?)",
+            zip([file_id] * len(names), range(len(names)), names, name_hashes, ids, parents))
+
+    def files_with_bone(self, name):
+        # [(path, bone_index)], looked up through the name hash index
+        name_hash = int(hash_bone_names([name])[0])
+        return self.connection.execute(
+            "SELECT files.path, bones.bone_index FROM bones JOIN files ON files.id = bones.file_id WHERE bones.name_hash = ? AND bones.name = ? ORDER BY files.path",
+            (name_hash, name)).fetchall()
+
+    def files_with_id(self, bone_id):
+        # [(path, bone_index, name)]
+        return self.connection.execute(
+            "SELECT files.path, bones.bone_index, bones.name FROM bones JOIN files ON files.id = bones.file_id WHERE bones.bone_id = ? ORDER BY files.path, bones.bone_index",
+            (bone_id,)).fetchall()
+
+    def same_hierarchy(self, path):
+        # Other files with the same bone names and parents as path
+        row = self.connection.execute("SELECT hierarchy_hash FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        if row is None:
+            raise RuntimeError(path + " is not in the index")
+        return [other_path for (other_path,) in self.connection.execute(
+            "SELECT path FROM files WHERE hierarchy_hash = ? AND path != ? ORDER BY path", (row[0], os.path.abspath(path)))]
+
+    def hierarchy_groups(self, min_size=2):
+        # Lists of files sharing a hierarchy, biggest groups first
+        groups = {}
+        for file_hierarchy_hash, path in self.connection.execute(
+                "SELECT hierarchy_hash, path FROM files WHERE hierarchy_hash IN (SELECT hierarchy_hash FROM files GROUP BY hierarchy_hash HAVING COUNT(*) >= ?) ORDER BY path",
+                (min_size,)):
+            groups.setdefault(file_hierarchy_hash, []).append(path)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def bones_of(self, path):
+        rows = self.connection.execute(
+            "SELECT bones.bone_index, bones.name, bones.name_hash, bones.bone_id, bones.parent FROM bones JOIN files ON files.id = bones.file_id WHERE files.path = ? ORDER BY bones.bone_index",
+            (os.path.abspath(path),)).fetchall()
+        return [{"index": index, "name": name, "name_hash": name_hash, "id": bone_id, "parent": parent} for index, name, name_hash, bone_id, parent in rows]
+
+    def summary(self):
+        file_count, bone_count = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(bone_count), 0) FROM files").fetchone()
+        name_count = self.connection.execute("SELECT COUNT(DISTINCT name_hash) FROM bones").fetchone()[0]
+        return {"files": file_count, "bones": bone_count, "distinct_names": name_count}
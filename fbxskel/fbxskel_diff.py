@@ -0,0 +1,129 @@
+import numpy as np
+import logging
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_skeleton import Skeleton
+from .fbxskel_math import transforms_moved
+from .fbxskel_writer import write_fbxskel, save_fbxskel
+from .fbxskel_hash import hash_bone_names
+
+DIFF_KEYS = ["added", "removed", "renamed", "reparented", "moved", "id_changed"]
+
+def match_bones(skeleton, other):
+    # For every bone of other, the index of the same bone in skeleton or -1. Bones are matched by name through
+    # their name hash, the leftovers then by mhws_skel_id when it is unambiguous on both sides (renamed bones).
+    # Hashes of the names rather than the stored ones, so a file with a broken name hash can't hide a bone
+    names = skeleton.names
+    other_names = other.names
+    by_hash = {}
+    for bone_i, name_hash in enumerate(hash_bone_names(names)):
+        by_hash.setdefault(name_hash, []).append(bone_i)
+    matches = np.full(len(other), -1, dtype=np.int64)
+    taken = np.zeros(len(skeleton), dtype=bool)
+    for other_i, name_hash in enumerate(hash_bone_names(other_names)):
+        # More than one candidate only on a hash collision or a duplicated name
+        for bone_i in by_hash.get(name_hash, ()):
+            if not taken[bone_i] and names[bone_i] == other_names[other_i]:
+                matches[other_i] = bone_i
+                taken[bone_i] = True
+                break
+
+    unmatched_other = np.flatnonzero(matches == -1)
+    unmatched = np.flatnonzero(~taken)
+    if len(unmatched_other) > 0 and len(unmatched) > 0:
+        ids, counts = np.unique(skeleton.ids[unmatched], return_counts=True)
+        other_ids, other_counts = np.unique(other.ids[unmatched_other], return_counts=True)
+        unique_ids = set(np.intersect1d(ids[counts == 1], other_ids[other_counts == 1]).tolist())
+        by_id = {bone_id: bone_i for bone_i, bone_id in zip(unmatched.tolist(), skeleton.ids[unmatched].tolist()) if bone_id in unique_ids}
+        for other_i, bone_id in zip(unmatched_other.tolist(), other.ids[unmatched_other].tolist()):
+            if bone_id in by_id:
+                matches[other_i] = by_id[bone_id]
+    return matches
+
+def diff_skeletons(skeleton, other, tolerance=1e-4):
+    # What it takes to go from skeleton to other, as lists of bone names
+    matches = match_bones(skeleton, other)
+    names = skeleton.names
+    other_names = other.names
+    matched_other = np.flatnonzero(matches != -1)
+    matched = matches[matched_other]
+
+    removed = np.ones(len(skeleton), dtype=bool)
+    removed[matched] = False
+    # A parent that only exists in other maps to -2, so it can't be mistaken for a root
+    other_parents = other.parents[matched_other].astype(np.int64)
+    parent_matches = np.where(matches == -1, -2, matches)
+    mapped_parents = np.where(other_parents >= 0, parent_matches[np.maximum(other_parents, 0)], -1)
+    reparented = np.flatnonzero(mapped_parents != skeleton.parents[matched])
+    moved = np.flatnonzero(transforms_moved(skeleton.rot[matched], skeleton.loc[matched], skeleton.scl[matched], other.rot[matched_other], other.loc[matched_other], other.scl[matched_other], tolerance))
+    id_changed = np.flatnonzero(skeleton.ids[matched] != other.ids[matched_other])
+
+    def parent_name(bone_names, parent_i):
+        return None if parent_i < 0 else bone_names[parent_i]
+
+    diff = {}
+    diff["added"] = [other_names[other_i] for other_i in np.flatnonzero(matches == -1).tolist()]
+    diff["removed"] = [names[bone_i] for bone_i in np.flatnonzero(removed).tolist()]
+    diff["renamed"] = [(names[bone_i], other_names[other_i]) for bone_i, other_i in zip(matched.tolist(), matched_other.tolist()) if names[bone_i] != other_names[other_i]]
+    diff["reparented"] = [(other_names[matched_other[i]], parent_name(names, skeleton.parents[matched[i]]), parent_name(other_names, other.parents[matched_other[i]])) for i in reparented.tolist()]
+    diff["moved"] = [other_names[matched_other[i]] for i in moved.tolist()]
+    diff["id_changed"] = [(other_names[matched_other[i]], int(skeleton.ids[matched[i]]), int(other.ids[matched_other[i]])) for i in id_changed.tolist()]
+    return diff
+
+def diff_is_empty(diff):
+    return not any(diff[key] for key in DIFF_KEYS)
+
+def format_diff(diff, max_names=10):
+    parts = []
+    for key in DIFF_KEYS:
+        entries = diff[key]
+        if not entries:
+            continue
+        shown = [entry if isinstance(entry, str) else " -> ".join(str(value) for value in entry) for entry in entries[:max_names]]
+        if len(entries) > max_names:
+            shown.append("...")
+        parts.append(str(len(entries)) + " " + key.replace("_", " ") + " (" + ", ".join(shown) + ")")
+    return "; ".join(parts) if parts else "identical"
+
+def merge_skeletons(skeleton, other, overwrite=False):
+    # skeleton plus the bones of other it doesn't have, appended in other's order with their parents
+    # remapped to merged indices. With overwrite, bones found in both take other's transforms and ids.
+    # The hash table gets rebuilt and sorted by write_fbxskel
+    matches = match_bones(skeleton, other)
+    added = np.flatnonzero(matches == -1)
+    merged_count = len(skeleton) + len(added)
+    if merged_count > np.iinfo(np.int16).max:
+        raise RuntimeError("Merged skeleton would have " + str(merged_count) + " bones, more than a parent index can address")
+    merged_indices = matches.copy()
+    merged_indices[added] = len(skeleton) + np.arange(len(added))
+    added_parents = other.parents[added].astype(np.int64)
+    added_parents = np.where(added_parents >= 0, merged_indices[np.maximum(added_parents, 0)], -1)
+
+    ids = np.concatenate([skeleton.ids, other.ids[added]])
+    rot = np.concatenate([skeleton.rot, other.rot[added]])
+    loc = np.concatenate([skeleton.loc, other.loc[added]])
+    scl = np.concatenate([skeleton.scl, other.scl[added]])
+    if overwrite:
+        matched_other = np.flatnonzero(matches != -1)
+        matched = matches[matched_other]
+        ids[matched] = other.ids[matched_other]
+        rot[matched] = other.rot[matched_other]
+        loc[matched] = other.loc[matched_other]
+        scl[matched] = other.scl[matched_other]
+
+    other_names = other.names
+    names = skeleton.names + [other_names[other_i] for other_i in added.tolist()]
+    parents = np.concatenate([skeleton.parents.astype(np.int64), added_parents])
+    name_hashes = np.concatenate([skeleton.name_hashes, other.name_hashes[added]])
+    return Skeleton(names, parents, ids, rot, loc, scl, name_hashes=name_hashes)
+
+def diff_files(path, other_path, tolerance=1e-4):
+    return diff_skeletons(Skeleton.from_file(path), Skeleton.from_file(other_path), tolerance)
+
+def merge_files(path, other_path, out_path, overwrite=False):
+    # Returns the merged skeleton, and whether out_path was written (False when it already held the same bytes)
+    merged = merge_skeletons(Skeleton.from_file(path), Skeleton.from_file(other_path), overwrite)
+    data, beware = write_fbxskel(merged)
+    if beware:
+        logger.warning("Warnings were generated while writing the merge of " + path + " and " + other_path)
+    return merged, save_fbxskel(out_path, data)
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import mmh3
+except ImportError:
+    mmh3 = None
+
+def murmurhash_32( key, seed = 0x0 ):
+    def fmix( h ):
+        h ^= h >> 16
+        h  = ( h * 0x85ebca6b ) & 0xFFFFFFFF
+        h ^= h >> 13
+        h  = ( h * 0xc2b2ae35 ) & 0xFFFFFFFF
+        h ^= h >> 16
+        return h
+    length = len( key )
+    nblocks = int( length / 4 )
+    h1 = seed
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    for block_start in range( 0, nblocks * 4, 4 ):
+        k1 = key[ block_start + 3 ] << 24 | \
+             key[ block_start + 2 ] << 16 | \
+             key[ block_start + 1 ] <<  8 | \
+             key[ block_start + 0 ]
+        k1 = ( c1 * k1 ) & 0xFFFFFFFF
+        k1 = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF
+        k1 = ( c2 * k1 ) & 0xFFFFFFFF
+        h1 ^= k1
+        h1  = ( h1 << 13 | h1 >> 19 ) & 0xFFFFFFFF
+        h1  = ( h1 * 5 + 0xe6546b64 ) & 0xFFFFFFFF
+    tail_index = nblocks * 4
+    k1 = 0
+    tail_size = length & 3
+    if tail_size >= 3:
+        k1 ^= key[ tail_index + 2 ] << 16
+    if tail_size >= 2:
+        k1 ^= key[ tail_index + 1 ] << 8
+    if tail_size >= 1:
+        k1 ^= key[ tail_index + 0 ]
+    if tail_size > 0:
+        k1  = ( k1 * c1 ) & 0xFFFFFFFF
+        k1  = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF
+        k1  = ( k1 * c2 ) & 0xFFFFFFFF
+        h1 ^= k1
+    unsigned_val = fmix( h1 ^ length )
+    return unsigned_val
+
+def _rotl32(x, r):
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+def murmurhash_32_batch(keys, seed = 0x0):
+    # Same result as murmurhash_32 for every key, computed column by column over a padded block matrix
+    count = len(keys)
+    if mmh3 is not None:
+        return np.array([mmh3.hash(key, seed, signed=False) for key in keys], dtype=np.uint32)
+    if count == 0:
+        return np.zeros(0, dtype=np.uint32)
+
+    lengths = np.fromiter((len(key) for key in keys), dtype=np.int64, count=count)
+    # One spare block per row so the tail of the longest key always has a column to land in
+    width = (int(lengths.max()) // 4 + 1) * 4
+    padded = np.zeros((count, width), dtype=np.uint8)
+    flat = np.frombuffer(b"".join(keys), dtype=np.uint8)
+    rows = np.repeat(np.arange(count), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    padded[rows, cols] = flat
+    blocks = padded.view("<u4")
+
+    c1 = np.uint32(0xcc9e2d51)
+    c2 = np.uint32(0x1b873593)
+    nblocks = lengths // 4
+    h1 = np.full(count, seed, dtype=np.uint32)
+    for block_i in range(int(nblocks.max())):
+        k1 = blocks[:, block_i] * c1
+        k1 = _rotl32(k1, 15) * c2
+        mixed = _rotl32(h1 ^ k1, 13) * np.uint32(5) + np.uint32(0xe6546b64)
+        h1 = np.where(nblocks > block_i, mixed, h1)
+
+    # Padding bytes are zero, so the block following the last full one is exactly the tail
+    k1 = blocks[np.arange(count), nblocks] * c1
+    k1 = _rotl32(k1, 15) * c2
+    h1 = np.where((lengths & 3) > 0, h1 ^ k1, h1)
+
+    h1 ^= lengths.astype(np.uint32)
+    h1 ^= h1 >> np.uint32(16)
+    h1 *= np.uint32(0x85ebca6b)
+    h1 ^= h1 >> np.uint32(13)
+    h1 *= np.uint32(0xc2b2ae35)
+    h1 ^= h1 >> np.uint32(16)
+    return h1
+
+NAME_HASH_CACHE_SIZE = 65536
+_name_hash_cache = OrderedDict()
+_name_hash_lock = threading.Lock()
+
+def clear_name_hash_cache():
+    with _name_hash_lock:
+        _name_hash_cache.clear()
+
+def hash_bone_names(names):
+    # Bone names repeat a lot across skeletons (root, Hip, Spine_0...), so their hashes are kept in a LRU
+    hashes = [None] * len(names)
+    missing = {}
+    with _name_hash_lock:
+        for name_i, name in enumerate(names):
+            name_hash = _name_hash_cache.get(name)
+            if name_hash is None:
+                missing.setdefault(name, []).append(name_i)
+            else:
+                _name_hash_cache.move_to_end(name)
+                hashes[name_i] = name_hash
+
+    if missing:
+        missing_names = list(missing)
+        missing_hashes = murmurhash_32_batch([name.encode("utf-16LE") for name in missing_names], 0xFFFFFFFF).tolist()
+        with _name_hash_lock:
+            for name, name_hash in zip(missing_names, missing_hashes):
+                for name_i in missing[name]:
+                    hashes[name_i] = name_hash
+                _name_hash_cache[name] = name_hash
+            while len(_name_hash_cache) > NAME_HASH_CACHE_SIZE:
+                _name_hash_cache.popitem(last=False)
+    return hashes
@@ -0,0 +1,67 @@
+import numpy as np
+import logging
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_parser import FbxskelParser, BONE_DTYPE, bone_table_to_infos
+from .fbxskel_hash import hash_bone_names
+
+class FbxskelIndex():
+    # Name lookups through the hash table stored in every fbxskel file: only the header and the
+    # hash table are decoded up front, a bone record and its name are read when a hash matches
+    def __init__(self, path=None, data=None):
+        self.parser = FbxskelParser(path=path, data=data)
+        self.bs = self.parser.bs
+        hash_table = self.parser.read_hash_table()
+        self.hashes = hash_table["hash"]
+        self.indices = hash_table["index"]
+        if np.any(self.hashes[1:] < self.hashes[:-1]):
+            # Not written by us: sort a copy rather than giving wrong answers
+            logger.warning(str(path) + " has an unsorted hash table")
+            order = np.argsort(self.hashes, kind="stable")
+            self.hashes = self.hashes[order]
+            self.indices = self.indices[order]
+
+    def __len__(self):
+        return self.parser.bone_count
+
+    def __contains__(self, name):
+        return self.contains(name)
+
+    def read_bone(self, bone_i):
+        if not 0 <= bone_i < self.parser.bone_count:
+            raise IndexError("Bone index " + str(bone_i) + " out of range")
+        self.bs.seek(self.parser.bone_offset + bone_i * BONE_DTYPE.itemsize)
+        bone_info = bone_table_to_infos(self.bs.readArray(BONE_DTYPE, 1))[0]
+        self.bs.seek(bone_info["name_offset"])
+        bone_info["name"] = self.bs.readStringUTF()
+        return bone_info
+
+    def find(self, name):
+        name_hash = hash_bone_names([name])[0]
+        start = int(np.searchsorted(self.hashes, name_hash, side="left"))
+        end = int(np.searchsorted(self.hashes, name_hash, side="right"))
+        # More than one entry only on a hash collision
+        for bone_i in self.indices[start:end].tolist():
+            bone_info = self.read_bone(bone_i)
+            if bone_info["name"] == name:
+                bone_info["index"] = bone_i
+                return bone_info
+        return None
+
+    def index_of(self, name):
+        bone_info = self.find(name)
+        return -1 if bone_info is None else bone_info["index"]
+
+    def contains(self, name):
+        return self.find(name) is not None
+
+    def close(self):
+        self.hashes = self.hashes.copy()
+        self.indices = self.indices.copy()
+        self.parser.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
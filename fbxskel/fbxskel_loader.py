@@ -3,15 +3,136 @@ from mathutils import Euler, Matrix, Vector, Quaternion
 
 import os
 import math
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 logger = logging.getLogger("wilds_suite")
 
 from .fbxskel_parser import FbxskelParser
+from .fbxskel_cache import skeleton_cache
+from .fbxskel_math import bone_world_matrices
+from .fbxskel_timing import timed
 
-def load_fbxskel(filepath, collection = None, fix_rotation=False, obj_name="", connect_bones=False):
-    parser = FbxskelParser(path=filepath)
-    fbxskel_data = parser.read()
+# Custom properties holding the file an armature was imported from and its mtime/size at that time, for watch mode
+SOURCE_PROPERTY = "fbxskel_source"
+SOURCE_STAT_PROPERTY = "fbxskel_source_stat"
+
+def source_signature(filepath):
+    # A string, ID properties can't hold a nanosecond mtime as an int
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return str(stat.st_mtime_ns) + ":" + str(stat.st_size)
+
+def set_source(armature_object, filepath):
+    filepath = os.path.abspath(filepath)
+    armature_object[SOURCE_PROPERTY] = filepath
+    signature = source_signature(filepath)
+    if signature is not None:
+        armature_object[SOURCE_STAT_PROPERTY] = signature
+
+def read_fbxskel(filepath, use_cache=True):
+    # No bpy in here: safe to call from worker threads
+    with timed("Decode " + filepath) as span:
+        if use_cache:
+            fbxskel_data = skeleton_cache.read(filepath)
+        else:
+            with FbxskelParser(path=filepath) as parser:
+                fbxskel_data = parser.read()
+        span["bones"] = len(fbxskel_data)
+    return fbxskel_data
+
+def content_key(filepath):
+    with open(filepath, "rb") as file_in:
+        data = file_in.read()
+    return (len(data), hashlib.blake2b(data, digest_size=16).digest())
+
+def read_fbxskel_files(filepaths, use_cache=True, max_workers=None):
+    # Decodes the files on a thread pool and yields (filepaths, fbxskel_data, error) as each one is ready,
+    # so the caller can build the Blender objects while the other files are still being parsed.
+    # The same file (selected twice, symlinked or hard linked) is only decoded once, found by path and stat.
+    # Only files whose size collides with another one get their content hashed to catch copies, the rest
+    # start parsing right away
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    by_real_path = {}
+    for filepath in filepaths:
+        by_real_path.setdefault(os.path.realpath(filepath), []).append(filepath)
+    by_size = {}
+    for real_path, paths in by_real_path.items():
+        try:
+            stat = os.stat(real_path)
+        except OSError as e:
+            yield paths, None, e
+            continue
+        # Some filesystems report no inode number
+        identity = (stat.st_dev, stat.st_ino or real_path)
+        by_size.setdefault(stat.st_size, {}).setdefault(identity, []).extend(paths)
+
+    def outcome(future, paths):
+        try:
+            return paths, future.result(), None
+        except Exception as e:
+            return paths, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # future -> (kind, paths). A read future's path list grows when a copy of its file is found later
+        pending = {}
+        reads_by_key = {}
+        for identities in by_size.values():
+            for paths in identities.values():
+                if len(identities) == 1:
+                    pending[executor.submit(read_fbxskel, paths[0], use_cache)] = ("read", paths)
+                else:
+                    pending[executor.submit(content_key, paths[0])] = ("key", paths)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, paths = pending.pop(future)
+                if kind == "read":
+                    yield outcome(future, paths)
+                    continue
+                try:
+                    key = future.result()
+                except Exception as e:
+                    yield paths, None, e
+                    continue
+                read_future = reads_by_key.get(key)
+                if read_future is None:
+                    read_future = reads_by_key[key] = executor.submit(read_fbxskel, paths[0], use_cache)
+                    pending[read_future] = ("read", paths)
+                elif read_future in pending:
+                    pending[read_future][1].extend(paths)
+                else:
+                    # The copy it matched was already handed out
+                    yield outcome(read_future, paths)
+
+def set_edit_bone_matrices(edit_bones, bone_refs, bone_indices, world_matrices, bulk=True):
+    # Rest matrices of bone_refs[bone_indices]. In bulk they all go through a single foreach_set, the other bones
+    # getting their own matrix back (foreach_get/foreach_set lay matrices out column-major), with one assignment
+    # per bone when that isn't available
+    world_matrices = np.asarray(world_matrices)
+    if bulk:
+        try:
+            if len(bone_indices) == len(bone_refs):
+                matrices = np.empty((len(bone_refs), 4, 4), dtype=np.float32)
+            else:
+                matrices = np.empty(len(bone_refs) * 16, dtype=np.float32)
+                edit_bones.foreach_get("matrix", matrices)
+                matrices = matrices.reshape(-1, 4, 4)
+            matrices[bone_indices] = world_matrices.transpose(0, 2, 1)
+            edit_bones.foreach_set("matrix", matrices.ravel())
+            return
+        except (TypeError, RuntimeError, AttributeError):
+            pass
+    for bone_i, world_matrix in zip(bone_indices, world_matrices.tolist()):
+        bone_refs[bone_i].matrix = Matrix(world_matrix)
+
+def load_fbxskel(filepath, collection = None, fix_rotation=False, obj_name="", connect_bones=False, use_cache=True, fbxskel_data=None):
+    if fbxskel_data is None:
+        fbxskel_data = read_fbxskel(filepath, use_cache=use_cache)
 
     file_name = os.path.basename(filepath)
     file_sname = file_name.split(".")
@@ -32,38 +153,113 @@ def load_fbxskel(filepath, collection = None, fix_rotation=False, obj_name="", c
 
     armature_data = bpy.data.armatures.new(armature_name)
     armature_object = bpy.data.objects.new(armature_name, armature_data)
+    set_source(armature_object, filepath)
     armature_object.show_in_front = True
     armature_object.rotation_mode = "XYZ"
-    if fix_rotation:
-        armature_object.rotation_euler.rotate(Euler([math.radians(90),0,0]))
+
+    # Every bone's rest matrix is computed up front, with the axis fix folded in
+    # instead of rotating the object and applying the transform afterwards
+    with timed("Bone matrices " + file_name) as span:
+        parents = np.array([bone_info["parent"] for bone_info in fbxskel_data], dtype=np.int64)
+        quats = np.array([bone_info["rot_quat"] for bone_info in fbxskel_data], dtype=np.float64).reshape(-1, 4)
+        locs = np.array([bone_info["loc"] for bone_info in fbxskel_data], dtype=np.float64).reshape(-1, 3)
+        world_matrices = bone_world_matrices(parents, quats, locs, fix_rotation=fix_rotation)
+        span["bones"] = len(parents)
 
     col.objects.link(armature_object)
     bpy.context.view_layer.objects.active = armature_object
-    bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-
-    for bone_info in fbxskel_data:
-        new_bone = armature_data.edit_bones.new(bone_info["name"])
-        new_bone.head = (0.0, 0.0, 0.0)
-        new_bone.tail = (0.0, 0.1, 0.0)
-        bone_loc = Vector([bone_info["loc"][0], bone_info["loc"][1], bone_info["loc"][2]])
-        bone_rot = Quaternion([bone_info["rot_quat"][3], bone_info["rot_quat"][0], bone_info["rot_quat"][1], bone_info["rot_quat"][2]])
-        bone_scl = Vector([bone_info["scl"][0], bone_info["scl"][1], bone_info["scl"][2]])
-        matrix = Matrix.LocRotScale(
-            bone_loc,
-            bone_rot,
-            bone_scl
-        )
-        new_tfr = new_bone.matrix @ matrix
-
-        if bone_info["parent"] != -1:
-            new_bone.parent = armature_data.edit_bones[bone_info["parent"]]
-            new_bone.matrix = new_bone.parent.matrix @ new_tfr
-        else:
-            new_bone.matrix = new_tfr
-        new_bone["mhws_skel_id"] = bone_info["id"]   
-    bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-    armature_object.select_set(True)
-    bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-    armature_object.select_set(False)
+    with timed("Edit mode enter " + file_name):
+        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
+
+    with timed("Edit bones " + file_name) as span:
+        edit_bones = armature_data.edit_bones
+        new_bones = []
+        for bone_info in fbxskel_data:
+            new_bone = edit_bones.new(bone_info["name"])
+            new_bone.tail = (0.0, 0.1, 0.0)
+            new_bone["mhws_skel_id"] = bone_info["id"]
+            new_bones.append(new_bone)
+
+        # Parents can only be linked once every bone exists, the file doesn't list parents first
+        for new_bone, parent_i in zip(new_bones, parents.tolist()):
+            if parent_i != -1:
+                new_bone.parent = new_bones[parent_i]
+        set_edit_bone_matrices(edit_bones, new_bones, list(range(len(new_bones))), world_matrices)
+        span["bones"] = len(new_bones)
+    with timed("Edit mode exit " + file_name):
+        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
 
     return [armature_object]
+
+def update_armature(armature_object, fbxskel_data, fix_rotation=False, match_by="NAME", only=None, source_path=None):
+    # Applies a skeleton onto an existing armature instead of building a new one, so meshes, modifiers and
+    # constraints using it are kept. Bones are matched by name or by mhws_skel_id: matched bones get the new
+    # rest matrix (keeping their length), parent and id, bones missing from the armature are added and bones
+    # the file doesn't have are left alone. only restricts the update to these file bone indices.
+    # Returns (matched bone count, added bone count)
+    with timed("Bone matrices " + armature_object.name) as span:
+        parents = np.array([bone_info["parent"] for bone_info in fbxskel_data], dtype=np.int64)
+        quats = np.array([bone_info["rot_quat"] for bone_info in fbxskel_data], dtype=np.float64).reshape(-1, 4)
+        locs = np.array([bone_info["loc"] for bone_info in fbxskel_data], dtype=np.float64).reshape(-1, 3)
+        world_matrices = bone_world_matrices(parents, quats, locs, fix_rotation=fix_rotation)
+        span["bones"] = len(parents)
+
+    if source_path is not None:
+        set_source(armature_object, source_path)
+    bpy.context.view_layer.objects.active = armature_object
+    with timed("Edit mode enter " + armature_object.name):
+        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
+
+    with timed("Update bones " + armature_object.name) as span:
+        edit_bones = armature_object.data.edit_bones
+        bone_refs = list(edit_bones)
+        if match_by == "ID":
+            keys = [bone.get("mhws_skel_id") for bone in bone_refs]
+            file_keys = [bone_info["id"] for bone_info in fbxskel_data]
+        else:
+            keys = [bone.name for bone in bone_refs]
+            file_keys = [bone_info["name"] for bone_info in fbxskel_data]
+        key_to_index = {}
+        for bone_i, key in enumerate(keys):
+            if key is not None:
+                key_to_index.setdefault(key, bone_i)
+
+        matches = []
+        for key in file_keys:
+            # A bone of the armature is only used once, even if the file repeats an id
+            matches.append(key_to_index.pop(key, -1))
+        matched_count = sum(1 for bone_i in matches if bone_i != -1)
+
+        added = []
+        for file_i, bone_info in enumerate(fbxskel_data):
+            if matches[file_i] == -1:
+                new_bone = edit_bones.new(bone_info["name"])
+                new_bone.tail = (0.0, 0.1, 0.0)
+                matches[file_i] = len(bone_refs)
+                bone_refs.append(new_bone)
+                added.append(file_i)
+
+        # Added bones always get their id, parent and matrix, whatever only says
+        if only is None:
+            selected = list(range(len(fbxskel_data)))
+        else:
+            selected = sorted(set(np.asarray(only).tolist()) | set(added))
+        for file_i in selected:
+            bone = bone_refs[matches[file_i]]
+            bone["mhws_skel_id"] = fbxskel_data[file_i]["id"]
+            parent_i = int(parents[file_i])
+            parent = None if parent_i == -1 else bone_refs[matches[parent_i]]
+            if bone.parent != parent:
+                bone.parent = parent
+
+        # Only the full update goes through foreach_set: writing every matrix back would re-derive head, tail
+        # and roll of the untouched bones through float32 on each reload
+        selected_matches = [matches[file_i] for file_i in selected]
+        set_edit_bone_matrices(edit_bones, bone_refs, selected_matches, world_matrices[selected], bulk=only is None)
+        span["matched"] = matched_count
+        span["updated"] = len(selected)
+        span["added"] = len(fbxskel_data) - matched_count
+    with timed("Edit mode exit " + armature_object.name):
+        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
+
+    return matched_count, len(fbxskel_data) - matched_count
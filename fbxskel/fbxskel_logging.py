@@ -0,0 +1,61 @@
+import os
+import sys
+import platform
+import logging
+logger = logging.getLogger("fbxskel_tools")
+
+class ColoredFormatter(logging.Formatter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ANSI Coloring
+        grey = "\x1b[38;20m"
+        yellow = "\x1b[33;20m"
+        red = "\x1b[31;20m"
+        bold_red = "\x1b[31;1m"
+        _reset = "\x1b[0m"
+        self.FORMATS = {
+            logging.DEBUG: f"{grey}{self._fmt}{_reset}",
+            logging.INFO: f"{grey}{self._fmt}{_reset}",
+            logging.WARNING: f"{yellow}{self._fmt}{_reset}",
+            logging.ERROR: f"{red}{self._fmt}{_reset}",
+            logging.CRITICAL: f"{bold_red}{self._fmt}{_reset}"
+        }
+
+    def format(self, record):
+        log_fmt = self.FORMATS.get(record.levelno)
+        formatter = logging.Formatter(log_fmt)
+        return formatter.format(record)
+
+def enable_windows_colors():
+    # Turns on ANSI escape handling in the console directly, instead of shelling out to "color" for the same effect
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)
+        mode = ctypes.c_uint32()
+        if kernel32.GetConsoleMode(handle, ctypes.byref(mode)) and kernel32.SetConsoleMode(handle, mode.value | 0x0004):
+            return
+    except Exception:
+        pass
+    os.system("color")
+
+_handler = None
+
+def setup_logging():
+    # Done on the first operator run rather than when Blender loads the addon
+    global _handler
+    if _handler is not None:
+        return
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(levelname)s | %(message)s')
+    colored_formatter = formatter
+    is_windows = platform.system() == "Windows"
+    if not (is_windows and int(platform.release()) < 10):
+        if is_windows:
+            enable_windows_colors()
+        colored_formatter = ColoredFormatter('%(levelname)s | %(message)s')
+    handler.setFormatter(colored_formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    _handler = handler
@@ -0,0 +1,135 @@
+import numpy as np
+
+# Rotation applied to go from the game's Y-up space to Blender's Z-up space
+FIX_ROTATION_MATRIX = np.array([
+    [1.0, 0.0, 0.0, 0.0],
+    [0.0, 0.0, -1.0, 0.0],
+    [0.0, 1.0, 0.0, 0.0],
+    [0.0, 0.0, 0.0, 1.0],
+])
+
+def quats_to_matrices(quats):
+    # quats are stored x, y, z, w like in the fbxskel files, and get normalized like mathutils does
+    quats = np.asarray(quats, dtype=np.float64).reshape(-1, 4)
+    norms = np.linalg.norm(quats, axis=1, keepdims=True)
+    valid = norms > 1e-12
+    quats = np.where(valid, quats / np.where(valid, norms, 1.0), [0.0, 0.0, 0.0, 1.0])
+    x, y, z, w = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    matrices = np.empty((len(quats), 3, 3))
+    matrices[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    matrices[:, 0, 1] = 2.0 * (x * y - z * w)
+    matrices[:, 0, 2] = 2.0 * (x * z + y * w)
+    matrices[:, 1, 0] = 2.0 * (x * y + z * w)
+    matrices[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    matrices[:, 1, 2] = 2.0 * (y * z - x * w)
+    matrices[:, 2, 0] = 2.0 * (x * z - y * w)
+    matrices[:, 2, 1] = 2.0 * (y * z + x * w)
+    matrices[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return matrices
+
+def rigid_matrices(quats, locs):
+    rotations = quats_to_matrices(quats)
+    matrices = np.zeros((len(rotations), 4, 4))
+    matrices[:, :3, :3] = rotations
+    matrices[:, :3, 3] = np.asarray(locs, dtype=np.float64).reshape(-1, 3)
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+def compose_hierarchy(parents, local_matrices):
+    # Parent composition done one hierarchy level at a time, so the bone order in the file doesn't matter
+    parents = np.asarray(parents, dtype=np.int64)
+    bone_count = len(parents)
+    if np.any((parents < -1) | (parents >= bone_count)):
+        raise RuntimeError("Parent index out of range in the bone hierarchy")
+    world_matrices = np.empty_like(local_matrices)
+    done = parents == -1
+    world_matrices[done] = local_matrices[done]
+    safe_parents = np.where(done, 0, parents)
+    while not np.all(done):
+        ready = ~done & done[safe_parents]
+        if not np.any(ready):
+            raise RuntimeError("Cycle found in the bone hierarchy")
+        world_matrices[ready] = world_matrices[parents[ready]] @ local_matrices[ready]
+        done |= ready
+    return world_matrices
+
+def subtree_mask(parents, mask):
+    # Extends mask to every descendant of the bones it holds, one hierarchy level at a time
+    parents = np.asarray(parents, dtype=np.int64)
+    mask = np.array(mask, dtype=bool)
+    has_parent = (parents >= 0) & (parents < len(parents))
+    safe_parents = np.where(has_parent, parents, 0)
+    while True:
+        grown = mask | (has_parent & mask[safe_parents])
+        if np.array_equal(grown, mask):
+            return mask
+        mask = grown
+
+def bone_world_matrices(parents, quats, locs, fix_rotation=False):
+    # Edit bones don't carry scale: the old importer dropped it when reading back parent.matrix,
+    # so only the rigid part of each local transform takes part in the composition
+    world_matrices = compose_hierarchy(parents, rigid_matrices(quats, locs))
+    if fix_rotation:
+        world_matrices = FIX_ROTATION_MATRIX @ world_matrices
+    return world_matrices
+
+def matrices_to_quats(rotations):
+    # Returns normalized x, y, z, w quaternions with w >= 0, which is what mathutils hands back
+    m = np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3)
+    m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+    m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+    m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+    trace = m00 + m11 + m22
+
+    # Shepperd's method: every candidate is computed, the numerically safest one is kept per row
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = 2.0 * np.sqrt(np.maximum(1.0 + trace, 1e-30))
+        from_w = np.stack([(m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s, 0.25 * s], axis=1)
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m00 - m11 - m22, 1e-30))
+        from_x = np.stack([0.25 * s, (m01 + m10) / s, (m02 + m20) / s, (m21 - m12) / s], axis=1)
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m11 - m00 - m22, 1e-30))
+        from_y = np.stack([(m01 + m10) / s, 0.25 * s, (m12 + m21) / s, (m02 - m20) / s], axis=1)
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m22 - m00 - m11, 1e-30))
+        from_z = np.stack([(m02 + m20) / s, (m12 + m21) / s, 0.25 * s, (m10 - m01) / s], axis=1)
+    choice = np.argmax(np.stack([trace, m00, m11, m22], axis=1), axis=1)
+    quats = np.choose(choice[:, None], [from_w, from_x, from_y, from_z])
+
+    quats[quats[:, 3] < 0.0] *= -1.0
+    norms = np.linalg.norm(quats, axis=1, keepdims=True)
+    return quats / np.where(norms > 0.0, norms, 1.0)
+
+def decompose_matrices(matrices):
+    # Same split as Matrix.decompose(): column lengths for the scale, negated along with the
+    # rotation when the matrix flips handedness
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    locs = matrices[:, :3, 3].copy()
+    mat3 = matrices[:, :3, :3]
+    scales = np.linalg.norm(mat3, axis=1)
+    rotations = mat3 / np.where(scales > 0.0, scales, 1.0)[:, None, :]
+    negative = np.linalg.det(rotations) < 0.0
+    rotations[negative] *= -1.0
+    scales[negative] *= -1.0
+    return locs, matrices_to_quats(rotations), scales
+
+def export_local_matrices(parents, matrix_locals, armature_matrix):
+    # Roots go back to the game's Y-up space through the armature's world matrix, other bones are
+    # expressed relative to their parent and scaled by the armature's scale
+    parents = np.asarray(parents, dtype=np.int64)
+    matrix_locals = np.asarray(matrix_locals, dtype=np.float64).reshape(-1, 4, 4)
+    armature_matrix = np.asarray(armature_matrix, dtype=np.float64)
+    is_root = parents == -1
+    local_matrices = np.empty_like(matrix_locals)
+    local_matrices[is_root] = FIX_ROTATION_MATRIX.T @ armature_matrix @ matrix_locals[is_root]
+    scale_matrix = np.diag(np.append(np.linalg.norm(armature_matrix[:3, :3], axis=0), 1.0))
+    is_child = ~is_root
+    local_matrices[is_child] = scale_matrix @ np.linalg.inv(matrix_locals[parents[is_child]]) @ matrix_locals[is_child]
+    return local_matrices
+
+def transforms_moved(rot, loc, scl, other_rot, other_loc, other_scl, tolerance):
+    # Per-bone mask of transforms differing by more than the tolerance on any component, q and -q being the same rotation
+    rot = np.asarray(rot, dtype=np.float64).reshape(-1, 4)
+    other_rot = np.asarray(other_rot, dtype=np.float64).reshape(-1, 4)
+    rot_diff = np.minimum(np.abs(rot - other_rot).max(axis=1, initial=0.0), np.abs(rot + other_rot).max(axis=1, initial=0.0))
+    loc_diff = np.abs(np.asarray(loc, dtype=np.float64) - other_loc).reshape(-1, 3).max(axis=1, initial=0.0)
+    scl_diff = np.abs(np.asarray(scl, dtype=np.float64) - other_scl).reshape(-1, 3).max(axis=1, initial=0.0)
+    return (rot_diff > tolerance) | (loc_diff > tolerance) | (scl_diff > tolerance)
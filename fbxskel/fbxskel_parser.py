@@ -4,17 +4,78 @@ import json
 from glob import glob
 import os
 import math
+import mmap
+import tarfile
+import zipfile
 import numpy as np
 import logging
 logger = logging.getLogger("wilds_suite")
 
+from .fbxskel_timing import timed
+
+BONE_DTYPE = np.dtype([
+    ("name_offset", "<u8"),
+    ("name_hash", "<u4"),
+    ("parent", "<i2"),
+    ("id", "<u2"),
+    ("rot_quat", "<f4", (4,)),
+    ("loc", "<f4", (3,)),
+    ("scl", "<f4", (3,)),
+    ("padding", "<u8"),
+])
+
+HEADER_SIZE = 48
+
+# Parent indices are stored as int16
+MAX_BONE_COUNT = 32767
+MAX_BONE_ID = 65535
+
+def check_bone_ranges(bone_count, parents, ids, max_parent=MAX_BONE_COUNT - 1):
+    # Parents and ids get packed into int16 / uint16 fields, anything out of range would silently wrap
+    if bone_count > MAX_BONE_COUNT:
+        raise RuntimeError(str(bone_count) + " bones, a skeleton holds at most " + str(MAX_BONE_COUNT))
+    parents = np.asarray(parents).reshape(-1)
+    bad = np.flatnonzero((parents < -1) | (parents > max_parent))
+    if len(bad):
+        raise RuntimeError("Bone " + str(int(bad[0])) + " has parent " + str(parents[bad[0]]) + ", outside -1.." + str(max_parent))
+    ids = np.asarray(ids).reshape(-1)
+    bad = np.flatnonzero((ids < 0) | (ids > MAX_BONE_ID))
+    if len(bad):
+        raise RuntimeError("Bone " + str(int(bad[0])) + " has id " + str(ids[bad[0]]) + ", outside 0.." + str(MAX_BONE_ID))
+
+HASH_DTYPE = np.dtype([
+    ("hash", "<u4"),
+    ("index", "<u4"),
+])
+
 class Reader():
     def __init__(self, data):
         self.offset = 0
         self.data = data
 
+    @classmethod
+    def from_file(cls, path):
+        # Map the file instead of reading it: only the pages we actually decode get touched
+        with open(path, "rb") as file_in:
+            try:
+                data = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Empty files (and some special files) can't be mapped
+                data = file_in.read()
+        return cls(data)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # Arrays handed out by readArray still look into the mapping: it gets unmapped
+                # once the last of them is garbage collected
+                pass
+        self.data = b""
+
     def read(self, kind, size):
-        result = struct.unpack(kind, self.data[self.offset:self.offset+size])[0]
+        result = struct.unpack_from(kind, self.data, self.offset)[0]
         self.offset += size
         return result
 
@@ -58,26 +119,60 @@ class Reader():
     def readUByte(self):
         return self.read("B", 1)
 
+    def readArray(self, dtype, count):
+        dtype = np.dtype(dtype)
+        result = np.frombuffer(self.data, dtype=dtype, count=count, offset=self.offset)
+        self.offset += dtype.itemsize * count
+        return result
+
+    def findTerminator(self, width):
+        # Look for a NUL character of the given width, aligned on the current offset
+        terminator = b"\x00" * width
+        end = self.data.find(terminator, self.offset)
+        while end != -1 and (end - self.offset) % width != 0:
+            end = self.data.find(terminator, end + 1)
+        if end == -1:
+            raise RuntimeError("Unterminated string at offset " + str(self.offset))
+        return end
+
     def readString(self):
-        text = ""
-        while True:
-            char = self.readUByte()
-            if char == 0:
-                break
-            else:
-                text += chr(char)
+        end = self.findTerminator(1)
+        text = self.data[self.offset:end].decode("latin-1")
+        self.offset = end + 1
         return text
 
     def readStringUTF(self):
-        text = ""
-        while True:
-            char = self.readUShort()
-            if char == 0:
-                break
-            else:
-                text += chr(char)
+        end = self.findTerminator(2)
+        text = self.data[self.offset:end].decode("utf-16-le", "surrogatepass")
+        self.offset = end + 2
         return text
 
+    def readStringsUTF(self, offsets):
+        # Resolves a whole string table at once: every terminator after the first string is located
+        # in a single pass over a uint16 view, then the strings are decoded in file order
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) == 0:
+            return []
+        start = int(offsets.min())
+        if np.any((offsets - start) % 2 != 0):
+            texts = []
+            for offset in offsets.tolist():
+                self.seek(offset)
+                texts.append(self.readStringUTF())
+            return texts
+        units = np.frombuffer(self.data, dtype="<u2", count=(self.getSize() - start) // 2, offset=start)
+        terminators = np.flatnonzero(units == 0) * 2 + start
+        terminator_indices = np.searchsorted(terminators, offsets)
+        if np.any(terminator_indices >= len(terminators)):
+            raise RuntimeError("Unterminated string in string table starting at offset " + str(start))
+        ends = terminators[terminator_indices].tolist()
+        starts = offsets.tolist()
+        texts = [None] * len(starts)
+        for i in np.argsort(offsets, kind="stable").tolist():
+            texts[i] = self.data[starts[i]:ends[i]].decode("utf-16-le", "surrogatepass")
+        self.offset = max(ends) + 2
+        return texts
+
     def allign_soft(self, size, shift=0):
         if (self.offset-shift)%size == 0:
             pass
@@ -93,30 +188,128 @@ class Reader():
     def getSize(self):
         return len(self.data)
 
+class PositionedReader(Reader):
+    # Reads through positioned calls on an open file: nothing is loaded or mapped beyond
+    # the bytes a read asks for
+    def __init__(self, file_in):
+        self.offset = 0
+        self.file = file_in
+        self.fd = file_in.fileno()
+        self.size = os.fstat(self.fd).st_size
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(open(path, "rb"))
+
+    def close(self):
+        self.file.close()
+
+    def readAt(self, offset, size):
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, size, offset)
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def read(self, kind, size):
+        result = struct.unpack(kind, self.readAt(self.offset, size))[0]
+        self.offset += size
+        return result
+
+    def readBytes(self, size):
+        buf = self.readAt(self.offset, size)
+        if len(buf) != size:
+            logger.warning("readBytes read " + str(len(buf)) + " instead of " + str(size))
+        self.offset += size
+        return buf
+
+    def readArray(self, dtype, count):
+        dtype = np.dtype(dtype)
+        result = np.frombuffer(self.readAt(self.offset, dtype.itemsize * count), dtype=dtype, count=count)
+        self.offset += dtype.itemsize * count
+        return result
+
+    def readTerminated(self, width):
+        chunk_size = 256
+        while True:
+            chunk = Reader(self.readAt(self.offset, chunk_size))
+            try:
+                end = chunk.findTerminator(width)
+            except RuntimeError:
+                if self.offset + chunk_size >= self.size:
+                    raise RuntimeError("Unterminated string at offset " + str(self.offset))
+                chunk_size *= 2
+                continue
+            text = chunk.data[:end]
+            self.offset += end + width
+            return text
+
+    def readString(self):
+        return self.readTerminated(1).decode("latin-1")
+
+    def readStringUTF(self):
+        return self.readTerminated(2).decode("utf-16-le", "surrogatepass")
+
+    def readStringsUTF(self, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) == 0:
+            return []
+        # The string table sits at the end of the file: one read from the first name onwards
+        start = int(offsets.min())
+        table = Reader(self.readAt(start, self.size - start))
+        texts = table.readStringsUTF(offsets - start)
+        self.offset = start + table.tell()
+        return texts
+
+    def getSize(self):
+        return self.size
+
 class FbxskelParser():
-    def __init__(self, path=None, streaming_path=None, data=None):
+    def __init__(self, path=None, streaming_path=None, data=None, positioned=False):
         self.path = path
         if streaming_path is not None:
             self.streaming_path = streaming_path
+        elif self.path is not None:
+            self.streaming_path = self.path.replace("natives/stm", "natives/stm/streaming")
         else:
-            self.streaming_path = self.path
-            self.streaming_path = self.streaming_path.replace("natives/stm", "natives/stm/streaming")
-        self.bs_streaming = None
-        # print("self.streaming_path = ", self.streaming_path)
-        try:
-            with open(self.streaming_path, "rb") as file_in:
-                streaming_data = file_in.read()
-            self.bs_streaming = Reader(streaming_data)
-        except:
-            pass
-        if data is None:
-            with open(path, "rb") as file_in:
-                data = file_in.read()
-        self.bs = Reader(data)
-
-    def read(self, LOD=0):
-        debug = {}
-
+            self.streaming_path = None
+        self._bs_streaming = None
+        self._streaming_loaded = False
+        if data is None and positioned:
+            self.bs = PositionedReader.from_file(path)
+        elif data is None:
+            self.bs = Reader.from_file(path)
+        else:
+            self.bs = Reader(data)
+
+    @property
+    def bs_streaming(self):
+        # The streaming counterpart is only opened the first time someone asks for it
+        if not self._streaming_loaded:
+            self._streaming_loaded = True
+            try:
+                self._bs_streaming = Reader.from_file(self.streaming_path)
+            except:
+                pass
+        return self._bs_streaming
+
+    def close(self):
+        # Arrays decoded from the mapping must not outlive it
+        if getattr(self, "bone_table", None) is not None:
+            self.bone_table = self.bone_table.copy()
+        if getattr(self, "hash_table", None) is not None:
+            self.hash_table = self.hash_table.copy()
+        self.bs.close()
+        if self._bs_streaming is not None:
+            self._bs_streaming.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_header(self):
+        self.bs.seek(0)
         self.version = self.bs.readUInt()
         self.magic = self.bs.readUInt()
         if self.magic != 1852599155 or self.version != 7:
@@ -124,50 +317,179 @@ class FbxskelParser():
 
         _ = self.bs.readUInt64()
 
-        bone_offset = self.bs.readUInt64()
-        hash_offset = self.bs.readUInt64()
-
-        bone_count = self.bs.readUShort()
-
-        self.bs.seek(bone_offset)
-        bone_infos = []
-        for bone_i in range(bone_count):
-            bone_info = {}
-            bone_info["name_offset"] = self.bs.readUInt64()
-            bone_info["name_hash"] = self.bs.readUInt()
-            bone_info["parent"] = self.bs.readShort()
-            bone_info["id"] = self.bs.readUShort()
-            bone_info["rot_quat"] = [self.bs.readFloat() for _ in range(4)]
-            bone_info["loc"] = [self.bs.readFloat() for _ in range(3)]
-            bone_info["scl"] = [self.bs.readFloat() for _ in range(3)]
-            bone_info["padding"] = self.bs.readUInt64()
-            bone_infos.append(bone_info)
-
-#         # Why does that even exists
-#         self.bs.seek(hash_offset)
-#         for bone_info in bone_infos:
-#             bone_info["hash"] = self.bs.readUInt()
-#
-#             bone_info["haid"] = self.bs.readUInt()
-
-        for bone_info in bone_infos:
-            self.bs.seek(bone_info["name_offset"])
-            bone_info["name"] = self.bs.readStringUTF()
-
+        self.bone_offset = self.bs.readUInt64()
+        self.hash_offset = self.bs.readUInt64()
+
+        self.bone_count = self.bs.readUShort()
+
+    def read_bone_table(self):
+        self.read_header()
+        self.bs.seek(self.bone_offset)
+        self.bone_table = self.bs.readArray(BONE_DTYPE, self.bone_count)
+        return self.bone_table
+
+    def read_hash_table(self):
+        # Pairs of (murmurhash of the UTF-16 name, bone index), sorted by hash. Only FbxskelIndex needs it
+        self.read_header()
+        self.bs.seek(self.hash_offset)
+        self.hash_table = self.bs.readArray(HASH_DTYPE, self.bone_count)
+        return self.hash_table
+
+    def read_columns(self, fields=None, start=0, stop=None):
+        # Only the requested columns of the [start, stop) bone range get decoded; "name" is accepted
+        # as a field too and resolves the names of that range only
+        if fields is None:
+            fields = list(BONE_DTYPE.names) + ["name"]
+        self.read_header()
+        start = max(0, start)
+        stop = self.bone_count if stop is None else min(stop, self.bone_count)
+        count = max(0, stop - start)
+        record_fields = [field for field in BONE_DTYPE.names if field in fields or (field == "name_offset" and "name" in fields)]
+        unknown_fields = [field for field in fields if field not in BONE_DTYPE.names and field != "name"]
+        if unknown_fields:
+            raise KeyError("Unknown bone fields " + str(unknown_fields))
+
+        self.bs.seek(self.bone_offset + start * BONE_DTYPE.itemsize)
+        table = self.bs.readArray(BONE_DTYPE[record_fields], count)
+        columns = {field: table[field] for field in record_fields if field in fields}
+        if "name" in fields:
+            columns["name"] = self.bs.readStringsUTF(table["name_offset"])
+        return columns
+
+    def iter_bones(self, fields=None, start=0, stop=None):
+        columns = self.read_columns(fields=fields, start=start, stop=stop)
+        columns = {field: column if isinstance(column, list) else column.tolist() for field, column in columns.items()}
+        start = min(max(0, start), self.bone_count)
+        stop = self.bone_count if stop is None else max(start, min(stop, self.bone_count))
+        for row_i, bone_i in enumerate(range(start, stop)):
+            bone_info = {field: column[row_i] for field, column in columns.items()}
+            bone_info["index"] = bone_i
+            yield bone_info
 
+    def read(self, LOD=0):
+        with timed("Parse " + str(self.path)) as span:
+            bone_table = self.read_bone_table()
+            bone_infos = bone_table_to_infos(bone_table)
 
+            names = self.bs.readStringsUTF(bone_table["name_offset"])
+            for bone_info, name in zip(bone_infos, names):
+                bone_info["name"] = name
+            span["bones"] = len(bone_infos)
 
         return bone_infos
 
-if __name__ == "__main__":
-    from glob import glob
-    import json
-    fbxskel_files = glob("ch07_000_0000.fbxskel.7", recursive=True)
-    for fbxskel_file in fbxskel_files:
-        try:
-            parser = FbxskelParser(path=fbxskel_file)
-            data = parser.read()
-            print(json.dumps(data, indent="\t"))
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+class FbxskelStreamParser():
+    # Parses from any binary file-like object (open file, zip/tar member, BytesIO) and yields the bones
+    # one by one. Everything is read front to back: header, bone table, then the names in offset order
+    CHUNK_SIZE = 65536
+
+    def __init__(self, stream, path=None):
+        self.stream = stream
+        self.path = path
+        self.seekable = stream.seekable() if hasattr(stream, "seekable") else False
+        self.base = stream.tell() if self.seekable else 0
+        self.position = 0
+        self.buffer = b""
+        self.buffer_pos = 0
+
+    def readExact(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.stream.read(remaining)
+            if not chunk:
+                raise RuntimeError(str(self.path) + " ended after " + str(self.position) + " bytes")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            self.position += len(chunk)
+        return b"".join(chunks)
+
+    def moveTo(self, offset):
+        self.buffer = b""
+        self.buffer_pos = 0
+        if offset == self.position:
+            return
+        if offset > self.position and (not self.seekable or offset - self.position <= self.CHUNK_SIZE):
+            # Skipping forward by reading keeps non-seekable streams (and compressed members) cheap
+            while self.position < offset:
+                chunk = self.stream.read(min(self.CHUNK_SIZE, offset - self.position))
+                if not chunk:
+                    raise RuntimeError(str(self.path) + " ended after " + str(self.position) + " bytes")
+                self.position += len(chunk)
+        else:
+            self.stream.seek(self.base + offset)
+            self.position = offset
+
+    def readStringUTFAt(self, offset):
+        buffer_start = self.position - len(self.buffer)
+        if not buffer_start + self.buffer_pos <= offset <= self.position:
+            self.moveTo(offset)
+            buffer_start = offset
+        self.buffer_pos = offset - buffer_start
+        while True:
+            reader = Reader(self.buffer)
+            reader.seek(self.buffer_pos)
+            try:
+                end = reader.findTerminator(2)
+            except RuntimeError:
+                chunk = self.stream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    raise RuntimeError("Unterminated string at offset " + str(offset))
+                self.position += len(chunk)
+                self.buffer = self.buffer[self.buffer_pos:] + chunk
+                self.buffer_pos = 0
+                continue
+            text = self.buffer[self.buffer_pos:end].decode("utf-16-le", "surrogatepass")
+            self.buffer_pos = end + 2
+            return text
+
+    def read_header(self):
+        if self.position != 0:
+            self.moveTo(0)
+        header = FbxskelParser(path=self.path, data=self.readExact(HEADER_SIZE))
+        header.read_header()
+        self.version = header.version
+        self.magic = header.magic
+        self.bone_offset = header.bone_offset
+        self.hash_offset = header.hash_offset
+        self.bone_count = header.bone_count
+
+    def iter_bones(self):
+        self.read_header()
+        self.moveTo(self.bone_offset)
+        bone_table = np.frombuffer(self.readExact(self.bone_count * BONE_DTYPE.itemsize), dtype=BONE_DTYPE)
+        bone_infos = bone_table_to_infos(bone_table)
+        # Names come out in file order, so each bone is yielded with its index
+        for bone_i in np.argsort(bone_table["name_offset"], kind="stable").tolist():
+            bone_info = bone_infos[bone_i]
+            bone_info["name"] = self.readStringUTFAt(bone_info["name_offset"])
+            bone_info["index"] = bone_i
+            yield bone_info
+
+    def read(self):
+        bone_infos = {}
+        for bone_info in self.iter_bones():
+            bone_infos[bone_info.pop("index")] = bone_info
+        return [bone_infos[bone_i] for bone_i in range(len(bone_infos))]
+
+def iter_archive_fbxskel(archive_path, extension=".fbxskel.7"):
+    # Yields (member name, stream) for every skeleton inside a zip or tar archive, without extracting
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith(extension):
+                    with archive.open(member) as stream:
+                        yield member.filename, stream
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(extension):
+                    with archive.extractfile(member) as stream:
+                        yield member.name, stream
+    else:
+        raise RuntimeError(str(archive_path) + " is neither a zip nor a tar archive")
+
+def bone_table_to_infos(bone_table):
+    # tolist() hands back plain python ints/floats, same as the struct based reader did
+    columns = [bone_table[field].tolist() for field in BONE_DTYPE.names]
+    return [dict(zip(BONE_DTYPE.names, row)) for row in zip(*columns)]
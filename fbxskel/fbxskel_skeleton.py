@@ -0,0 +1,167 @@
+import numpy as np
+import logging
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_parser import FbxskelParser, check_bone_ranges
+from .fbxskel_hash import hash_bone_names
+
+class Bone():
+    # Lightweight view on one bone of a Skeleton, nothing is copied
+    __slots__ = ("skeleton", "index")
+
+    def __init__(self, skeleton, index):
+        self.skeleton = skeleton
+        self.index = index
+
+    @property
+    def name(self):
+        return self.skeleton.name(self.index)
+
+    @property
+    def parent(self):
+        return int(self.skeleton.parents[self.index])
+
+    @property
+    def id(self):
+        return int(self.skeleton.ids[self.index])
+
+    @property
+    def name_hash(self):
+        return int(self.skeleton.name_hashes[self.index])
+
+    @property
+    def rot(self):
+        return self.skeleton.rot[self.index]
+
+    @property
+    def loc(self):
+        return self.skeleton.loc[self.index]
+
+    @property
+    def scl(self):
+        return self.skeleton.scl[self.index]
+
+    def __repr__(self):
+        return "Bone(" + str(self.index) + ", " + repr(self.name) + ", parent=" + str(self.parent) + ", id=" + str(self.id) + ")"
+
+class Skeleton():
+    # One skeleton as contiguous arrays. Names are kept as a single NUL separated string with end offsets
+    # (they can't contain NUL, the file stores them NUL terminated) and the name -> index dict is only built
+    # on the first lookup, so thousands of skeletons can stay in memory at once
+    __slots__ = ("parents", "ids", "rot", "loc", "scl", "name_hashes", "_names", "_name_ends", "_name_to_index")
+
+    def __init__(self, names, parents, ids, rot, loc, scl, name_hashes=None):
+        names = list(names)
+        bone_count = len(names)
+        check_bone_ranges(bone_count, parents, ids)
+        self._names = "\x00".join(names)
+        self._name_ends = np.cumsum(np.array([len(name) + 1 for name in names], dtype=np.int64)) - 1
+        self._name_to_index = None
+        self.parents = np.array(parents, dtype=np.int16).reshape(bone_count)
+        self.ids = np.array(ids, dtype=np.uint16).reshape(bone_count)
+        self.rot = np.array(rot, dtype=np.float32).reshape(bone_count, 4)
+        self.loc = np.array(loc, dtype=np.float32).reshape(bone_count, 3)
+        self.scl = np.array(scl, dtype=np.float32).reshape(bone_count, 3)
+        if name_hashes is None:
+            name_hashes = hash_bone_names(names)
+        self.name_hashes = np.array(name_hashes, dtype=np.uint32).reshape(bone_count)
+
+    @classmethod
+    def from_parser(cls, parser):
+        bone_table = parser.read_bone_table()
+        names = parser.bs.readStringsUTF(bone_table["name_offset"])
+        return cls(names, bone_table["parent"], bone_table["id"], bone_table["rot_quat"], bone_table["loc"], bone_table["scl"], name_hashes=bone_table["name_hash"])
+
+    @classmethod
+    def from_file(cls, path):
+        with FbxskelParser(path=path) as parser:
+            return cls.from_parser(parser)
+
+    @classmethod
+    def from_bytes(cls, data, path=None):
+        with FbxskelParser(path=path, data=data) as parser:
+            return cls.from_parser(parser)
+
+    @classmethod
+    def from_bone_infos(cls, bone_infos):
+        # FbxskelParser.read() output
+        return cls(
+            [bone_info["name"] for bone_info in bone_infos],
+            [bone_info["parent"] for bone_info in bone_infos],
+            [bone_info["id"] for bone_info in bone_infos],
+            [bone_info["rot_quat"] for bone_info in bone_infos],
+            [bone_info["loc"] for bone_info in bone_infos],
+            [bone_info["scl"] for bone_info in bone_infos],
+        )
+
+    @classmethod
+    def from_columns(cls, bone_columns):
+        # Writer columns, as built by bone_columns_from_infos
+        return cls(bone_columns["name"], bone_columns["parent_id"], bone_columns["id"], bone_columns["rot"], bone_columns["loc"], bone_columns["scl"])
+
+    def to_columns(self):
+        bone_columns = {}
+        bone_columns["name"] = self.names
+        bone_columns["index"] = np.arange(len(self))
+        bone_columns["id"] = self.ids
+        bone_columns["parent_id"] = self.parents
+        bone_columns["loc"] = self.loc
+        bone_columns["rot"] = self.rot
+        bone_columns["scl"] = self.scl
+        return bone_columns
+
+    def to_bone_infos(self):
+        # Same shape as FbxskelParser.read(), minus the on-disk offsets and padding
+        columns = {
+            "name_hash": self.name_hashes.tolist(),
+            "parent": self.parents.tolist(),
+            "id": self.ids.tolist(),
+            "rot_quat": self.rot.tolist(),
+            "loc": self.loc.tolist(),
+            "scl": self.scl.tolist(),
+            "name": self.names,
+        }
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    def to_bytes(self):
+        from .fbxskel_writer import write_fbxskel
+        data, _ = write_fbxskel(self)
+        return data
+
+    @property
+    def names(self):
+        return self._names.split("\x00") if len(self) > 0 else []
+
+    def name(self, bone_i):
+        end = int(self._name_ends[bone_i])
+        start = int(self._name_ends[bone_i - 1]) + 1 if bone_i > 0 else 0
+        return self._names[start:end]
+
+    def index_of(self, name):
+        if self._name_to_index is None:
+            self._name_to_index = {}
+            for bone_i, bone_name in enumerate(self.names):
+                self._name_to_index.setdefault(bone_name, bone_i)
+        return self._name_to_index.get(name, -1)
+
+    def __contains__(self, name):
+        return self.index_of(name) != -1
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __getitem__(self, bone_i):
+        if bone_i < 0:
+            bone_i += len(self)
+        if not 0 <= bone_i < len(self):
+            raise IndexError("Bone index " + str(bone_i) + " out of range")
+        return Bone(self, bone_i)
+
+    def __iter__(self):
+        for bone_i in range(len(self)):
+            yield Bone(self, bone_i)
+
+    @property
+    def nbytes(self):
+        arrays = [self.parents, self.ids, self.rot, self.loc, self.scl, self.name_hashes, self._name_ends]
+        return sum(array.nbytes for array in arrays) + len(self._names.encode("utf-8"))
@@ -0,0 +1,39 @@
+import time
+import cProfile
+import contextlib
+import logging
+logger = logging.getLogger("fbxskel_tools")
+
+@contextlib.contextmanager
+def timed(phase):
+    # Times a phase and logs it at DEBUG. The yielded dict collects counts to log along with it,
+    # e.g. span["bones"] = len(bone_infos)
+    span = {}
+    if not logger.isEnabledFor(logging.DEBUG):
+        yield span
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield span
+    finally:
+        elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+        details = ", ".join(key + "=" + str(value) for key, value in span.items())
+        logger.debug(phase + ": " + format(elapsed_ms, ".3f") + " ms" + (" (" + details + ")" if details else ""))
+
+@contextlib.contextmanager
+def profiled(prof_path):
+    # cProfile capture of the main thread into prof_path, or nothing if prof_path is empty
+    if not prof_path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        try:
+            profile.dump_stats(prof_path)
+            logger.info("Profile written to " + prof_path)
+        except Exception as e:
+            logger.warning("Could not write profile to " + prof_path + ", reason = " + str(e))
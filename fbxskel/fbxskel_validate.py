@@ -0,0 +1,126 @@
+import numpy as np
+import logging
+logger = logging.getLogger("wilds_suite")
+
+from .fbxskel_parser import FbxskelParser, BONE_DTYPE, HASH_DTYPE, HEADER_SIZE
+from .fbxskel_hash import hash_bone_names
+
+MAX_REPORTED_ITEMS = 20
+UNIT_QUAT_TOLERANCE = 1e-3
+
+def add_issue(report, check, message, items=None, key="bones"):
+    # items are the offending bone (or hash table entry) indices, only the first few are kept
+    issue = {"check": check, "message": message}
+    if items is not None:
+        items = np.asarray(items).tolist()
+        shown = ", ".join(str(item) for item in items[:MAX_REPORTED_ITEMS]) + (", ..." if len(items) > MAX_REPORTED_ITEMS else "")
+        issue["message"] = message + ": " + str(len(items)) + " " + key + " (" + shown + ")"
+        issue["count"] = len(items)
+        issue[key] = items[:MAX_REPORTED_ITEMS]
+    report["issues"].append(issue)
+
+def unrooted_bones(parents):
+    # Bones that never reach a root when walking up their parents: the members of a cycle and everything below them.
+    # Parents must already be in range
+    done = parents == -1
+    safe_parents = np.where(done, 0, parents)
+    while True:
+        ready = ~done & done[safe_parents]
+        if not np.any(ready):
+            break
+        done |= ready
+    return np.flatnonzero(~done)
+
+def validate_tables(bs, bone_table, hash_table, report):
+    bone_count = len(bone_table)
+
+    parents = bone_table["parent"].astype(np.int64)
+    out_of_range = np.flatnonzero((parents < -1) | (parents >= bone_count))
+    if len(out_of_range) > 0:
+        add_issue(report, "parent_range", "Parent index out of range", out_of_range)
+    else:
+        unrooted = unrooted_bones(parents)
+        if len(unrooted) > 0:
+            add_issue(report, "parent_cycle", "Cycle in the hierarchy", unrooted)
+
+    floats = np.concatenate([bone_table["rot_quat"], bone_table["loc"], bone_table["scl"]], axis=1)
+    non_finite = np.flatnonzero(~np.all(np.isfinite(floats), axis=1))
+    if len(non_finite) > 0:
+        add_issue(report, "non_finite", "NaN or infinite transform", non_finite)
+    with np.errstate(invalid="ignore", over="ignore"):
+        norms = np.linalg.norm(bone_table["rot_quat"].astype(np.float64), axis=1)
+    non_unit = np.flatnonzero(np.isfinite(norms) & (np.abs(norms - 1.0) > UNIT_QUAT_TOLERANCE))
+    if len(non_unit) > 0:
+        add_issue(report, "non_unit_quaternion", "Rotation quaternion not unit length", non_unit)
+
+    names = None
+    name_offsets = bone_table["name_offset"]
+    bad_offsets = np.flatnonzero((name_offsets < HEADER_SIZE) | (name_offsets > max(bs.getSize() - 2, 0)))
+    if len(bad_offsets) > 0:
+        add_issue(report, "name_offset", "Name offset outside of the file", bad_offsets)
+    else:
+        try:
+            names = bs.readStringsUTF(name_offsets)
+        except Exception as e:
+            add_issue(report, "name_offset", "Names can't be read, " + str(e))
+
+    expected_hashes = None
+    if names is not None:
+        _, inverse, counts = np.unique(np.array(names, dtype=str), return_inverse=True, return_counts=True)
+        duplicates = np.flatnonzero(counts[inverse.reshape(-1)] > 1)
+        if len(duplicates) > 0:
+            add_issue(report, "duplicate_name", "Name used by more than one bone", duplicates)
+        expected_hashes = np.asarray(hash_bone_names(names), dtype=np.uint32)
+        bad_hashes = np.flatnonzero(bone_table["name_hash"] != expected_hashes)
+        if len(bad_hashes) > 0:
+            add_issue(report, "name_hash", "Bone name hash doesn't match the name", bad_hashes)
+
+    if hash_table is None:
+        return
+    hashes = hash_table["hash"]
+    unsorted = np.flatnonzero(hashes[1:] < hashes[:-1]) + 1
+    if len(unsorted) > 0:
+        add_issue(report, "hash_order", "Hash table not sorted", unsorted, key="entries")
+    indices = hash_table["index"].astype(np.int64)
+    valid = indices < bone_count
+    if not np.all(valid):
+        add_issue(report, "hash_index", "Hash table entry pointing past the last bone", np.flatnonzero(~valid), key="entries")
+    missing = np.flatnonzero(np.bincount(indices[valid], minlength=bone_count) != 1)
+    if len(missing) > 0:
+        add_issue(report, "hash_index", "Bone missing from the hash table, or listed more than once", missing)
+    if expected_hashes is not None:
+        wrong = np.flatnonzero(valid & (hashes != expected_hashes[np.where(valid, indices, 0)]))
+        if len(wrong) > 0:
+            add_issue(report, "hash_value", "Hash table entry doesn't match the name of its bone", wrong, key="entries")
+
+def validate_parser(parser, report):
+    bs = parser.bs
+    file_size = bs.getSize()
+    if file_size < HEADER_SIZE:
+        add_issue(report, "header", "File is " + str(file_size) + " bytes, smaller than the header")
+        return
+    parser.read_header()
+    bone_count = parser.bone_count
+    report["bone_count"] = bone_count
+    bone_end = parser.bone_offset + bone_count * BONE_DTYPE.itemsize
+    hash_end = parser.hash_offset + bone_count * HASH_DTYPE.itemsize
+    if bone_end > file_size:
+        add_issue(report, "bone_table", "Bone table ends at " + str(bone_end) + ", past the end of the file (" + str(file_size) + " bytes)")
+        return
+    hash_table = None
+    if hash_end > file_size:
+        add_issue(report, "hash_table", "Hash table ends at " + str(hash_end) + ", past the end of the file (" + str(file_size) + " bytes)")
+    else:
+        hash_table = parser.read_hash_table()
+    validate_tables(bs, parser.read_bone_table(), hash_table, report)
+
+def validate_fbxskel(path=None, data=None):
+    # Structured report: {"path", "bone_count", "ok", "issues": [{"check", "message", "count", "bones"/"entries"}]}
+    report = {"path": path, "bone_count": None, "issues": []}
+    try:
+        with FbxskelParser(path=path, data=data) as parser:
+            validate_parser(parser, report)
+    except Exception as e:
+        add_issue(report, "read", str(e))
+    report["ok"] = not report["issues"]
+    return report
@@ -0,0 +1,150 @@
+import bpy
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logging
+logger = logging.getLogger("fbxskel_tools")
+
+from .fbxskel_loader import read_fbxskel, update_armature, source_signature, SOURCE_PROPERTY, SOURCE_STAT_PROPERTY
+from .fbxskel_math import transforms_moved, subtree_mask
+
+WATCH_INTERVAL = 1.0
+WATCH_TOLERANCE = 1e-6
+
+# Source path -> {"stat", "pending_stat", "data", "future", "future_stat"}
+_sources = {}
+_executor = None
+
+def watched_armatures():
+    armatures = {}
+    for obj in bpy.data.objects:
+        if obj.type == "ARMATURE":
+            path = obj.get(SOURCE_PROPERTY)
+            if path:
+                armatures.setdefault(path, []).append(obj)
+    return armatures
+
+def changed_bone_indices(old_data, new_data):
+    # Bones whose transform, parent or id changed between two parses of a file, plus all their descendants
+    # since edit bones are posed in armature space and a moved parent moves its whole subtree.
+    # None when bones were added, removed or renamed and the whole skeleton has to be applied
+    if len(old_data) != len(new_data) or any(old["name"] != new["name"] for old, new in zip(old_data, new_data)):
+        return None
+    columns = {}
+    for key in ["rot_quat", "loc", "scl", "parent", "id"]:
+        columns[key] = (np.array([bone_info[key] for bone_info in old_data]), np.array([bone_info[key] for bone_info in new_data]))
+    changed = transforms_moved(columns["rot_quat"][0], columns["loc"][0], columns["scl"][0], columns["rot_quat"][1], columns["loc"][1], columns["scl"][1], WATCH_TOLERANCE)
+    changed |= columns["parent"][0] != columns["parent"][1]
+    changed |= columns["id"][0] != columns["id"][1]
+    return np.flatnonzero(subtree_mask(columns["parent"][1], changed))
+
+def submit_parse(source, path, signature):
+    source["future"] = _executor.submit(read_fbxskel, path, False)
+    source["future_stat"] = signature
+
+def apply_reload(path, objs, old_data, new_data, signature):
+    only = changed_bone_indices(old_data, new_data) if old_data is not None else None
+    if only is not None and len(only) == 0:
+        logger.info(path + " changed on disk, but no bone did")
+        for obj in objs:
+            obj[SOURCE_STAT_PROPERTY] = signature
+        return
+    view_layer = bpy.context.view_layer
+    previous_active = view_layer.objects.active
+    for obj in objs:
+        # Entering edit mode needs the armature in the current view layer
+        if view_layer.objects.get(obj.name) is None:
+            continue
+        update_armature(obj, new_data, fix_rotation=True, only=only)
+        obj[SOURCE_STAT_PROPERTY] = signature
+        logger.info("Reloaded " + path + " into " + obj.name + " (" + ("all" if only is None else str(len(only))) + " bone(s) updated)")
+    view_layer.objects.active = previous_active
+
+def poll_sources():
+    # A stat per watched file, whatever the skeleton sizes. Parsing happens on the worker thread and the
+    # result is applied on a later tick
+    armatures = watched_armatures()
+    for path in list(_sources):
+        if path not in armatures:
+            del _sources[path]
+
+    for path, objs in armatures.items():
+        signature = source_signature(path)
+        source = _sources.get(path)
+        if source is None:
+            # First sighting: parsed once as the reference later versions get compared to
+            source = _sources[path] = {"stat": signature, "pending_stat": None, "data": None, "future": None, "future_stat": None}
+            if signature is not None:
+                submit_parse(source, path, signature)
+            continue
+
+        future = source["future"]
+        if future is not None:
+            if not future.done():
+                continue
+            try:
+                new_data = future.result()
+            except Exception as e:
+                # Most likely caught mid-write, the next change of the file will trigger another parse
+                logger.debug("Could not parse " + path + " for watch mode, reason = " + str(e))
+                source["future"] = None
+                source["stat"] = source["future_stat"]
+                continue
+            if source["data"] is not None or source["future_stat"] != source["stat"]:
+                targets = objs
+            else:
+                # First parse: it's only the reference, except for armatures imported from another version of the
+                # file (changed before watch mode was turned on, or while the .blend was closed), which get all of it
+                targets = [obj for obj in objs if obj.get(SOURCE_STAT_PROPERTY) not in (None, source["future_stat"])]
+            if targets:
+                # Edit mode can't be entered while the user is in another mode: keep the result for a later tick
+                if bpy.context.mode != "OBJECT":
+                    continue
+                try:
+                    apply_reload(path, targets, source["data"], new_data, source["future_stat"])
+                except Exception as e:
+                    # Dropped like a failed parse, otherwise it would be retried and logged on every tick.
+                    # The old data is kept so the next change of the file applies these bones again
+                    logger.warning("Could not reload " + path + ", reason = " + str(e))
+                    source["future"] = None
+                    source["stat"] = source["future_stat"]
+                    continue
+            source["data"] = new_data
+            source["stat"] = source["future_stat"]
+            source["future"] = None
+
+        if signature is None or signature == source["stat"]:
+            source["pending_stat"] = None
+        elif signature == source["pending_stat"]:
+            # Unchanged since the last tick: the external tool is done writing
+            submit_parse(source, path, signature)
+            source["pending_stat"] = None
+        else:
+            source["pending_stat"] = signature
+
+def watch_tick():
+    try:
+        poll_sources()
+    except Exception as e:
+        logger.warning("Watch mode error, reason = " + str(e))
+    return WATCH_INTERVAL
+
+def is_watching():
+    return bpy.app.timers.is_registered(watch_tick)
+
+def start_watch():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+    if not is_watching():
+        bpy.app.timers.register(watch_tick, first_interval=WATCH_INTERVAL, persistent=True)
+
+def stop_watch():
+    global _executor
+    if is_watching():
+        bpy.app.timers.unregister(watch_tick)
+    _sources.clear()
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
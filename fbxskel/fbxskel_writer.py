@@ -1,28 +1,58 @@
-import bpy
-from mathutils import Matrix, Vector, Euler, Quaternion
-
+import os
 import struct
+import hashlib
+import shutil
+import threading
 import math
 import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import logging
 logger = logging.getLogger("wilds_suite")
 
+from .fbxskel_parser import FbxskelParser, BONE_DTYPE, HASH_DTYPE, HEADER_SIZE, check_bone_ranges
+from .fbxskel_math import export_local_matrices, decompose_matrices, transforms_moved
+from .fbxskel_timing import timed
+from .fbxskel_hash import murmurhash_32, murmurhash_32_batch, hash_bone_names, clear_name_hash_cache
+from .fbxskel_skeleton import Skeleton
+
 class Writer():
-    def __init__(self):
-        self.data = b""
+    def __init__(self, size=0):
+        # The buffer is preallocated when the final size is known, and patched in place
+        self.data = bytearray(size)
+        self.offset = 0
 
     def tell(self):
-        return len(self.data)
+        return self.offset
+
+    def reserve(self, size):
+        if size > len(self.data):
+            self.data.extend(bytes(size - len(self.data)))
 
     def write(self, kind, value):
-        self.data += struct.pack(kind, value)
+        size = struct.calcsize(kind)
+        self.reserve(self.offset + size)
+        struct.pack_into(kind, self.data, self.offset, value)
+        self.offset += size
 
     def write_list(self, kind, value):
-        self.data += struct.pack(str(len(value))+kind, *value)
+        kind = str(len(value))+kind
+        size = struct.calcsize(kind)
+        self.reserve(self.offset + size)
+        struct.pack_into(kind, self.data, self.offset, *value)
+        self.offset += size
 
     def writeAt(self, kind, offset, value):
-        self.data = self.data[:offset] + struct.pack(kind, value) + self.data[offset+struct.calcsize(kind):]
+        struct.pack_into(kind, self.data, offset, value)
+
+    def writeBlock(self, value):
+        size = len(value)
+        self.reserve(self.offset + size)
+        self.data[self.offset:self.offset + size] = value
+        self.offset += size
+
+    def getBytes(self):
+        return bytes(memoryview(self.data)[:self.offset])
 
     def writeUInt64(self, value):
         self.write("Q", value)
@@ -91,59 +121,13 @@ class Writer():
         self.write_list("b", value)
 
     def writeString(self, value):
-        for char in value:
-            self.write("B", ord(char))
-        self.write("B", 0)
+        self.writeBlock(value.encode("latin-1") + b"\x00")
 
     def writeStringUTF(self, value):
-        for char in value:
-            self.write("H", ord(char))
-        self.write("H", 0)
+        self.writeBlock(value.encode("utf-16-le", "surrogatepass") + b"\x00\x00")
 
     def padUntilAlligned(self, size):
-        for pad_i in range((size - (len(self.data)%size))%size):
-            self.writeUByte(0)
-
-def murmurhash_32( key, seed = 0x0 ):
-    def fmix( h ):
-        h ^= h >> 16
-        h  = ( h * 0x85ebca6b ) & 0xFFFFFFFF
-        h ^= h >> 13
-        h  = ( h * 0xc2b2ae35 ) & 0xFFFFFFFF
-        h ^= h >> 16
-        return h
-    length = len( key )
-    nblocks = int( length / 4 )
-    h1 = seed
-    c1 = 0xcc9e2d51
-    c2 = 0x1b873593
-    for block_start in range( 0, nblocks * 4, 4 ):
-        k1 = key[ block_start + 3 ] << 24 | \
-             key[ block_start + 2 ] << 16 | \
-             key[ block_start + 1 ] <<  8 | \
-             key[ block_start + 0 ]
-        k1 = ( c1 * k1 ) & 0xFFFFFFFF
-        k1 = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF
-        k1 = ( c2 * k1 ) & 0xFFFFFFFF
-        h1 ^= k1
-        h1  = ( h1 << 13 | h1 >> 19 ) & 0xFFFFFFFF
-        h1  = ( h1 * 5 + 0xe6546b64 ) & 0xFFFFFFFF
-    tail_index = nblocks * 4
-    k1 = 0
-    tail_size = length & 3
-    if tail_size >= 3:
-        k1 ^= key[ tail_index + 2 ] << 16
-    if tail_size >= 2:
-        k1 ^= key[ tail_index + 1 ] << 8
-    if tail_size >= 1:
-        k1 ^= key[ tail_index + 0 ]
-    if tail_size > 0:
-        k1  = ( k1 * c1 ) & 0xFFFFFFFF
-        k1  = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF
-        k1  = ( k1 * c2 ) & 0xFFFFFFFF
-        h1 ^= k1
-    unsigned_val = fmix( h1 ^ length )
-    return unsigned_val
+        self.writeBlock(bytes((size - (self.offset%size))%size))
 
 def export_fbxskel(selected_objects):
     beware = False
@@ -173,80 +157,290 @@ def export_fbxskel(selected_objects):
         raise RuntimeError("More than one armature in the selected objects. ")
 
     armature = armatures[0]
-    armature_data = armature.data
-    armature_matrix = armature.matrix_world
-
-    bone_dict = {}
-    for bone_i, bone in enumerate(armature_data.bones):
-        bone_dict[bone.name] = bone_i
-
-    bone_infos = []
-    for bone_i, bone in enumerate(armature_data.bones):
-        bone_info = {}
-
-        rot4 = Matrix.Rotation(math.radians(-90.0), 4, 'X')
-        scale_mat = Matrix.LocRotScale(None, None, armature_matrix.to_scale())
-
-        if bone.parent is None:
-            local_mat = rot4 @ (armature_matrix @ armature_data.bones[bone.name].matrix_local)
-        else:
-            local_mat = scale_mat @ (armature_data.bones[bone.parent.name].matrix_local.inverted() @ armature_data.bones[bone.name].matrix_local)
-
-        loc, rot, scl = local_mat.decompose()
-        bone_info["name"] = bone.name
-        bone_info["parent"] = None if bone.parent is None else bone.parent.name
-        bone_info["index"] = bone_i
-        bone_info["id"] = bone["mhws_skel_id"]
-        bone_info["parent_id"] = -1 if bone.parent is None else bone_dict[bone.parent.name]
-        bone_info["loc"] = [x for x in loc]
-        bone_info["rot"] = [rot[1], rot[2], rot[3], rot[0]]
-        bone_info["scl"] = [x for x in scl]
-
-        bone_infos.append(bone_info)
-
-    return bone_infos, beware
+    with timed("Armature transforms " + armature.name) as span:
+        skeleton = armature_skeleton(armature)
+        span["bones"] = len(skeleton)
+    return skeleton, beware
+
+def armature_skeleton(armature):
+    bones = armature.data.bones
+    bone_count = len(bones)
+
+    # Pointers and custom properties can't go through foreach_get, this is the only per-bone pass
+    names = []
+    parent_names = []
+    ids = []
+    for bone in bones:
+        names.append(bone.name)
+        parent_names.append(None if bone.parent is None else bone.parent.name)
+        ids.append(bone["mhws_skel_id"])
+    bone_dict = {name: bone_i for bone_i, name in enumerate(names)}
+    parents = np.array([-1 if parent_name is None else bone_dict[parent_name] for parent_name in parent_names], dtype=np.int64)
+
+    matrix_locals = np.empty(bone_count * 16, dtype=np.float32)
+    bones.foreach_get("matrix_local", matrix_locals)
+    # foreach_get hands the matrices out column-major
+    matrix_locals = matrix_locals.reshape(-1, 4, 4).transpose(0, 2, 1)
+    armature_matrix = np.array(armature.matrix_world, dtype=np.float64)
+
+    local_matrices = export_local_matrices(parents, matrix_locals, armature_matrix)
+    locs, quats, scls = decompose_matrices(local_matrices)
+
+    return Skeleton(names, parents, ids, quats, locs, scls)
+
+def batch_file_stem(name):
+    # "ch03_000_0000 Armature" or "ch03_000_0000.fbxskel", as created by the importer, both give "ch03_000_0000"
+    for suffix in [" Armature", ".fbxskel.7", ".fbxskel"]:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def batch_file_names(names, clean_name=None):
+    # names holds (name, fallback name) per armature. The suffix is stripped from the raw name before clean_name
+    # (bpy.path.clean_name in Blender) turns its spaces and dots into "_". A name already taken gets the fallback
+    # appended, then a counter, compared case-insensitively for Windows
+    if clean_name is None:
+        clean_name = lambda name: name
+    file_names = []
+    used_names = set()
+    for name, fallback in names:
+        stem = clean_name(batch_file_stem(name))
+        file_name = stem + ".fbxskel.7"
+        if file_name.lower() in used_names:
+            stem = stem + "_" + clean_name(batch_file_stem(fallback))
+            file_name = stem + ".fbxskel.7"
+            counter = 2
+            while file_name.lower() in used_names:
+                file_name = stem + "_" + str(counter) + ".fbxskel.7"
+                counter += 1
+            logger.warning("Several armatures would be written to the same file, " + fallback + " goes to " + file_name)
+        used_names.add(file_name.lower())
+        file_names.append(file_name)
+    return file_names
+
+def export_fbxskel_batch(named_armatures, directory, max_workers=None):
+    # named_armatures yields (file_name, armature). The transforms are read on the calling thread, as Blender
+    # data has to be, while the skeletons already extracted are serialized and written on the worker pool.
+    # Returns (filepath, written, beware, error) per armature, in input order
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    def write_one(filepath, skeleton):
+        data, beware = write_fbxskel(skeleton)
+        with timed("Write " + filepath) as span:
+            span["bytes"] = len(data)
+            written = save_fbxskel(filepath, data)
+        return written, beware
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_name, armature in named_armatures:
+            filepath = os.path.join(directory, file_name)
+            try:
+                with timed("Armature transforms " + armature.name) as span:
+                    skeleton = armature_skeleton(armature)
+                    span["bones"] = len(skeleton)
+            except Exception as e:
+                pending.append((filepath, None, e))
+                continue
+            pending.append((filepath, executor.submit(write_one, filepath, skeleton), None))
+
+        results = []
+        for filepath, future, error in pending:
+            if error is None:
+                try:
+                    written, beware = future.result()
+                    results.append((filepath, written, beware, None))
+                    continue
+                except Exception as e:
+                    error = e
+            results.append((filepath, False, True, error))
+    return results
+
+def bone_columns_from_infos(bone_infos):
+    bone_columns = {}
+    for key in ["name", "index", "id", "parent_id", "loc", "rot", "scl"]:
+        bone_columns[key] = [bone_info[key] for bone_info in bone_infos]
+    return bone_columns
 
 def write_fbxskel(bone_infos):
+    # Takes a Skeleton, writer columns, or a list of per-bone dicts
+    with timed("Serialize") as span:
+        data, beware = serialize_fbxskel(bone_infos)
+        span["bones"] = len(bone_infos["name"]) if isinstance(bone_infos, dict) else len(bone_infos)
+        span["bytes"] = len(data)
+    return data, beware
+
+def serialize_fbxskel(bone_infos):
     beware = False
 
-    writer = Writer()
+    if isinstance(bone_infos, Skeleton):
+        bone_columns = bone_infos.to_columns()
+    elif isinstance(bone_infos, dict):
+        bone_columns = bone_infos
+    else:
+        bone_columns = bone_columns_from_infos(bone_infos)
+
+    names = bone_columns["name"]
+    bone_count = len(names)
+    check_bone_ranges(bone_count, bone_columns["parent_id"], bone_columns["id"], max_parent=bone_count - 1)
+    encoded_names = [name.encode("utf-16LE") for name in names]
+    name_hashes = hash_bone_names(names)
+
+    bone_offset = HEADER_SIZE
+    hash_offset = bone_offset + bone_count * BONE_DTYPE.itemsize
+    string_offset = hash_offset + bone_count * HASH_DTYPE.itemsize
+    string_table = b"".join(encoded_name + b"\x00\x00" for encoded_name in encoded_names)
+    name_sizes = np.array([len(encoded_name) + 2 for encoded_name in encoded_names], dtype=np.uint64)
+    name_offsets = string_offset + np.cumsum(name_sizes) - name_sizes
+
+    writer = Writer(string_offset + len(string_table))
     writer.writeUInt(7)
     writer.writeUInt(1852599155)
     writer.writeUInt64(0)
-
-    bone_offset = writer.tell()
-    writer.writeUInt64(0) # bone_offset
-    hash_offset = writer.tell()
-    writer.writeUInt64(0) # hash_offset
-
-    writer.writeUInt64(len(bone_infos))
+    writer.writeUInt64(bone_offset)
+    writer.writeUInt64(hash_offset)
+    writer.writeUInt64(bone_count)
     writer.writeUInt64(0)
 
-    writer.writeUInt64At(bone_offset, writer.tell())
-
-    for bone_info in bone_infos:
-        bone_info["name_offset"] = writer.tell()
-        writer.writeUInt64(0) # name_offset
-        writer.writeUInt(murmurhash_32(bone_info["name"].encode("utf-16LE"), 0xFFFFFFFF))
-        writer.writeShort(bone_info["parent_id"])
-        writer.writeUShort(bone_info["id"])
-        [writer.writeFloat(x) for x in bone_info["rot"]]
-        [writer.writeFloat(x) for x in bone_info["loc"]]
-        [writer.writeFloat(x) for x in bone_info["scl"]]
-        writer.writeUInt64(0)
-
-    writer.writeUInt64At(hash_offset, writer.tell())
-
-    bone_hashes = [(murmurhash_32(bone_info["name"].encode("utf-16LE"), 0xFFFFFFFF), bone_info["index"]) for bone_info in bone_infos]
-    bone_hashes.sort(key=lambda a: a[0])
-    #print(bone_hashes)
-
-    for bone_hash in bone_hashes:
-        writer.writeUInt(bone_hash[0])
-        writer.writeUInt(bone_hash[1])
-
-    for bone_info in bone_infos:
-        writer.writeUInt64At(bone_info["name_offset"], writer.tell())
-        writer.writeStringUTF(bone_info["name"])
-
-    return writer.data, beware
+    bone_table = np.zeros(bone_count, dtype=BONE_DTYPE)
+    bone_table["name_offset"] = name_offsets
+    bone_table["name_hash"] = name_hashes
+    bone_table["parent"] = bone_columns["parent_id"]
+    bone_table["id"] = bone_columns["id"]
+    bone_table["rot_quat"] = np.asarray(bone_columns["rot"], dtype=np.float64).reshape(-1, 4)
+    bone_table["loc"] = np.asarray(bone_columns["loc"], dtype=np.float64).reshape(-1, 3)
+    bone_table["scl"] = np.asarray(bone_columns["scl"], dtype=np.float64).reshape(-1, 3)
+    writer.writeBlock(bone_table.tobytes())
+
+    # Sorted by hash, ties keep the bone order
+    hash_table = np.zeros(bone_count, dtype=HASH_DTYPE)
+    hash_table["hash"] = name_hashes
+    hash_table["index"] = bone_columns["index"]
+    hash_table = hash_table[np.argsort(hash_table["hash"], kind="stable")]
+    writer.writeBlock(hash_table.tobytes())
+
+    writer.writeBlock(string_table)
+
+    return writer.getBytes(), beware
+
+def file_digest(filepath, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as file_in:
+        for chunk in iter(lambda: file_in.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def save_fbxskel(filepath, data):
+    # Writes data to filepath through a temp file in the same directory and os.replace, so an interrupted
+    # export never leaves a truncated file behind. Returns False when the file already holds these exact
+    # bytes, in which case it's left untouched (mtime included)
+    try:
+        if os.path.getsize(filepath) == len(data) and file_digest(filepath) == hashlib.blake2b(data, digest_size=16).digest():
+            return False
+    except OSError:
+        pass
+    filepath = os.path.abspath(filepath)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_path = temp_file_path(filepath)
+    try:
+        with open(temp_path, "xb") as file_out:
+            file_out.write(data)
+            file_out.flush()
+            os.fsync(file_out.fileno())
+        replace_with_temp(temp_path, filepath)
+    except BaseException:
+        remove_temp(temp_path)
+        raise
+    return True
+
+def temp_file_path(filepath):
+    # Same directory as filepath so os.replace never crosses filesystems
+    return filepath + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+def replace_with_temp(temp_path, filepath):
+    if os.path.exists(filepath):
+        # Keep the permissions of the file being replaced, like an in place write would
+        shutil.copymode(filepath, temp_path)
+    os.replace(temp_path, filepath)
+
+def remove_temp(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+def changed_bones(bone_table, skeleton, tolerance=1e-5):
+    # Bones whose transform moved by more than the tolerance or whose id changed.
+    # The tolerance keeps float noise from an import/export cycle from counting as an edit
+    changed = transforms_moved(bone_table["rot_quat"], bone_table["loc"], bone_table["scl"], skeleton.rot, skeleton.loc, skeleton.scl, tolerance)
+    changed |= bone_table["id"] != skeleton.ids
+    changed |= bone_table["name_hash"] != skeleton.name_hashes
+    return np.flatnonzero(changed)
+
+def patch_fbxskel(filepath, skeleton, tolerance=1e-5):
+    # Rewrites only the bone records that changed. They're patched into a copy of the file that then replaces
+    # it, so like save_fbxskel an interrupted export leaves the old file intact. Returns the number of patched bones,
+    # or None when the file can't be patched (missing, unreadable, different bone names or hierarchy)
+    if not os.path.isfile(filepath):
+        return None
+    try:
+        with FbxskelParser(path=filepath) as parser:
+            bone_table = parser.read_bone_table().copy()
+            names = parser.bs.readStringsUTF(bone_table["name_offset"])
+            bone_offset = parser.bone_offset
+    except Exception as e:
+        logger.info("Can't patch " + filepath + ", reason = " + str(e))
+        return None
+    if names != skeleton.names or not np.array_equal(bone_table["parent"], skeleton.parents):
+        return None
+
+    changed = changed_bones(bone_table, skeleton, tolerance)
+    if len(changed) == 0:
+        return 0
+    bone_table["name_hash"][changed] = skeleton.name_hashes[changed]
+    bone_table["id"][changed] = skeleton.ids[changed]
+    bone_table["rot_quat"][changed] = skeleton.rot[changed]
+    bone_table["loc"][changed] = skeleton.loc[changed]
+    bone_table["scl"][changed] = skeleton.scl[changed]
+
+    # One positioned write per run of consecutive changed bones
+    run_starts = np.flatnonzero(np.diff(changed, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], len(changed))
+    filepath = os.path.abspath(filepath)
+    temp_path = temp_file_path(filepath)
+    try:
+        shutil.copyfile(filepath, temp_path)
+        with open(temp_path, "r+b") as file_out:
+            for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+                first_bone = int(changed[run_start])
+                last_bone = int(changed[run_end - 1])
+                payload = bone_table[first_bone:last_bone + 1].tobytes()
+                offset = bone_offset + first_bone * BONE_DTYPE.itemsize
+                if hasattr(os, "pwrite"):
+                    os.pwrite(file_out.fileno(), payload, offset)
+                else:
+                    file_out.seek(offset)
+                    file_out.write(payload)
+            file_out.flush()
+            os.fsync(file_out.fileno())
+        replace_with_temp(temp_path, filepath)
+    except BaseException:
+        remove_temp(temp_path)
+        raise
+    return len(changed)
+
+def bone_infos_from_parsed(parsed_bone_infos):
+    # Turns FbxskelParser.read() output into what write_fbxskel expects
+    bone_infos = []
+    for bone_i, parsed in enumerate(parsed_bone_infos):
+        bone_info = {}
+        bone_info["name"] = parsed["name"]
+        bone_info["index"] = bone_i
+        bone_info["id"] = parsed["id"]
+        bone_info["parent_id"] = parsed["parent"]
+        bone_info["loc"] = list(parsed["loc"])
+        bone_info["rot"] = list(parsed["rot_quat"])
+        bone_info["scl"] = list(parsed["scl"])
+        bone_infos.append(bone_info)
+    return bone_infos
@@ -1,15 +1,15 @@
 import bpy
-from bpy.types import Panel
 from bpy_extras.io_utils import ImportHelper, ExportHelper
-import addon_utils
 
 import os
-import json
+import sys
+import time
+import tempfile
 import logging
 logger = logging.getLogger("fbxskel_tools")
 
-from .fbxskel_loader import load_fbxskel
-from .fbxskel_writer import export_fbxskel, write_fbxskel
+# Nothing heavier than bpy at module level: this is imported when Blender registers the addon, the
+# parser/writer (and NumPy with them) are imported inside execute()
 
 def SetLoggingLevel(level):
     if level == "DEBUG":
@@ -21,6 +21,28 @@ def SetLoggingLevel(level):
     elif level == "ERROR":
         logger.setLevel(logging.ERROR)
 
+def GetAddonPreferences(context):
+    import addon_utils
+    candidate_modules = [mod for mod in addon_utils.modules() if mod.bl_info["name"] == "MHWilds Fbxskel Importer Exporter"]
+    if len(candidate_modules) > 1:
+        logger.warning("Inconsistencies while loading the addon preferences: make sure you don't have multiple versions of the addon installed.")
+    mod = candidate_modules[0]
+    return context.preferences.addons[mod.__name__].preferences
+
+def TakeProfilePath(addon_prefs, operator_name):
+    # "Profile next run" is a one-shot switch: it turns itself back off once used
+    if not addon_prefs.profile_next_run:
+        return None
+    addon_prefs.profile_next_run = False
+    profile_dir = bpy.path.abspath(addon_prefs.profile_dir) if addon_prefs.profile_dir else (bpy.app.tempdir or tempfile.gettempdir())
+    return os.path.join(profile_dir, "fbxskel_" + operator_name + "_" + time.strftime("%Y%m%d_%H%M%S") + ".prof")
+
+
+def StopWatch():
+    # Only if watch mode was ever started, so unregistering doesn't import it
+    watch_module = sys.modules.get(__package__ + ".fbxskel_watch")
+    if watch_module is not None:
+        watch_module.stop_watch()
 
 class FBXSKEL_ImportFbxskel(bpy.types.Operator, ImportHelper):
     """Import from Wilds fbxskel file format (.fbxskel.7)"""
@@ -32,14 +54,33 @@ class FBXSKEL_ImportFbxskel(bpy.types.Operator, ImportHelper):
     
     files: bpy.props.CollectionProperty(type=bpy.types.PropertyGroup)
     filter_glob: bpy.props.StringProperty(default=".fbxskel;*.fbxskel.*")
+    parallel_decode: bpy.props.BoolProperty(
+        name="Parallel decoding",
+        description="Parse the selected files on worker threads while the armatures are being built",
+        default=True
+    )
+    update_existing: bpy.props.BoolProperty(
+        name="Update active armature",
+        description="Apply the skeleton onto the active armature instead of creating a new one: matching bones get the new rest transforms, missing bones are added",
+        default=False
+    )
+    match_by: bpy.props.EnumProperty(
+        name="Match bones by",
+        items = [('NAME','Name','Match bones by name','',0),
+                 ('ID','Skeleton id','Match bones by their mhws_skel_id property','',1)],
+        default = 'NAME'
+    )
 
     def execute(self, context):
-        candidate_modules = [mod for mod in addon_utils.modules() if mod.bl_info["name"] == "MHWilds Fbxskel Importer Exporter"]
-        if len(candidate_modules) > 1:
-            logger.warning("Inconsistencies while loading the addon preferences: make sure you don't have multiple versions of the addon installed.")
-        mod = candidate_modules[0]
-        addon_prefs = context.preferences.addons[mod.__name__].preferences
+        from .fbxskel_logging import setup_logging
+        from .fbxskel_loader import load_fbxskel, read_fbxskel_files, read_fbxskel, update_armature
+        from .fbxskel_cache import skeleton_cache
+        from .fbxskel_timing import timed, profiled
+        setup_logging()
+        addon_prefs = GetAddonPreferences(context)
         SetLoggingLevel(addon_prefs.logging_level)
+        skeleton_cache.max_bytes = addon_prefs.cache_size * 1024 * 1024
+        skeleton_cache.cache_dir = bpy.path.abspath(addon_prefs.cache_dir) if addon_prefs.cache_dir else None
         
         if self.files:
             folder = (os.path.dirname(self.filepath))
@@ -47,15 +88,42 @@ class FBXSKEL_ImportFbxskel(bpy.types.Operator, ImportHelper):
         else:
             filepaths = [str(self.filepath)]
 
-        for filepath in filepaths:
-            try:
-                objs = load_fbxskel(filepath, collection=None, fix_rotation=True)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                logger.warning("Unable to load fbxskel of path " + str(filepath) + ", reason = " + str(e))
-                self.report({"WARNING"}, "Unable to load fbxskel of path " + str(filepath) + ", reason = " + str(e))
-                continue
+        target_armature = None
+        if self.update_existing:
+            target_armature = context.active_object
+            if target_armature is None or target_armature.type != "ARMATURE":
+                self.report({"ERROR"}, "Update active armature is on, but the active object is not an armature")
+                return {"CANCELLED"}
+            if context.mode != "OBJECT":
+                bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
+
+        with profiled(TakeProfilePath(addon_prefs, "import")), timed("Import") as span:
+            span["files"] = len(filepaths)
+            if self.parallel_decode and len(filepaths) > 1:
+                decoded = read_fbxskel_files(filepaths, use_cache=addon_prefs.use_cache)
+            else:
+                decoded = (([filepath], None, None) for filepath in filepaths)
+
+            for group_filepaths, fbxskel_data, error in decoded:
+                for filepath in group_filepaths:
+                    try:
+                        if error is not None:
+                            raise error
+                        if target_armature is not None:
+                            if fbxskel_data is None:
+                                fbxskel_data = read_fbxskel(filepath, use_cache=addon_prefs.use_cache)
+                            matched, added = update_armature(target_armature, fbxskel_data, fix_rotation=True, match_by=self.match_by, source_path=filepath)
+                            logger.info("Applied " + str(filepath) + " onto " + target_armature.name + ": " + str(matched) + " bone(s) updated, " + str(added) + " added")
+                        else:
+                            objs = load_fbxskel(filepath, collection=None, fix_rotation=True, use_cache=addon_prefs.use_cache, fbxskel_data=fbxskel_data)
+                    except Exception as e:
+                        import traceback
+                        traceback.print_exc()
+                        logger.warning("Unable to load fbxskel of path " + str(filepath) + ", reason = " + str(e))
+                        self.report({"WARNING"}, "Unable to load fbxskel of path " + str(filepath) + ", reason = " + str(e))
+                        continue
+        if addon_prefs.use_cache:
+            skeleton_cache.log_stats()
         return {"FINISHED"}
 
 class FBXSKEL_ExportFbxskel(bpy.types.Operator, ExportHelper):
@@ -64,15 +132,50 @@ class FBXSKEL_ExportFbxskel(bpy.types.Operator, ExportHelper):
     bl_label = 'Export WILDS Fbxskel'
     filename_ext = ".7"
     # filter_glob: bpy.props.StringProperty(default="*.fbxskel", options={'HIDDEN'})
+    incremental: bpy.props.BoolProperty(
+        name="Incremental",
+        description="If the target file has the same bones, only patch the bones that changed into a copy of it that replaces the file (and skip the write when none did)",
+        default=False
+    )
+    incremental_tolerance: bpy.props.FloatProperty(
+        name="Tolerance",
+        description="Transform differences below this are not considered changes",
+        default=1e-5,
+        min=0.0,
+        precision=6
+    )
 
     def execute(self, context):
+        from .fbxskel_logging import setup_logging
+        from .fbxskel_writer import export_fbxskel, write_fbxskel, patch_fbxskel, save_fbxskel
+        from .fbxskel_timing import timed, profiled
+        setup_logging()
+        addon_prefs = GetAddonPreferences(context)
+        SetLoggingLevel(addon_prefs.logging_level)
         selected_objects = context.selected_objects
         beware = False
         try:
-            bone_infos, beware_export = export_fbxskel(selected_objects)
-            data, beware_write = write_fbxskel(bone_infos)
-            with open(self.filepath, "wb") as file_out:
-                file_out.write(data)
+            with profiled(TakeProfilePath(addon_prefs, "export")), timed("Export") as span:
+                skeleton, beware_export = export_fbxskel(selected_objects)
+                beware_write = False
+                patched = None
+                if self.incremental:
+                    with timed("Patch " + self.filepath) as patch_span:
+                        patched = patch_fbxskel(self.filepath, skeleton, self.incremental_tolerance)
+                        patch_span["patched"] = patched
+                if patched is None:
+                    data, beware_write = write_fbxskel(skeleton)
+                    with timed("Write " + self.filepath) as write_span:
+                        write_span["bytes"] = len(data)
+                        written = save_fbxskel(self.filepath, data)
+                        write_span["written"] = written
+                    if not written:
+                        logger.info(self.filepath + " is already up to date, left untouched")
+                elif patched == 0:
+                    logger.info("No bone changed, " + self.filepath + " left untouched")
+                else:
+                    logger.info("Patched " + str(patched) + " bone(s) in " + self.filepath)
+                span["bones"] = len(skeleton)
             beware = beware_export or beware_write
         except Exception as e:
             self.report({"ERROR"}, "Could not export fbxskel, reason = " + str(e))
@@ -87,4 +190,117 @@ class FBXSKEL_ExportFbxskel(bpy.types.Operator, ExportHelper):
             self.report({"INFO"}, "Export done!")
         return {"FINISHED"}
 
-        
+class FBXSKEL_ExportFbxskelBatch(bpy.types.Operator):
+    """Export every selected armature, or every armature of a collection, to its own fbxskel file (.fbxskel.7)"""
+    bl_idname = "wilds_export.wilds_fbxskel_batch"
+    bl_label = 'Batch Export WILDS Fbxskel'
+
+    directory: bpy.props.StringProperty(subtype="DIR_PATH")
+    filter_folder: bpy.props.BoolProperty(default=True, options={'HIDDEN'})
+    source: bpy.props.EnumProperty(
+        name="Armatures",
+        items = [('SELECTED','Selected','Every selected armature','',0),
+                 ('COLLECTION','Collection','Every armature in the collection, children collections included','',1)],
+        default = 'SELECTED'
+    )
+    collection: bpy.props.StringProperty(name="Collection")
+    name_from: bpy.props.EnumProperty(
+        name="File names from",
+        items = [('ARMATURE','Armature','Name each file after its armature object','',0),
+                 ('COLLECTION','Collection','Name each file after the collection holding its armature','',1)],
+        default = 'ARMATURE'
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "source")
+        if self.source == 'COLLECTION':
+            layout.prop_search(self, "collection", bpy.data, "collections")
+        layout.prop(self, "name_from")
+
+    def invoke(self, context, event):
+        if not self.collection and context.collection is not None:
+            self.collection = context.collection.name
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def named_armatures(self, context):
+        from .fbxskel_writer import batch_file_names
+        if self.source == 'COLLECTION':
+            collection = bpy.data.collections.get(self.collection)
+            if collection is None:
+                raise RuntimeError("Collection " + self.collection + " not found. ")
+            objects = collection.all_objects
+        else:
+            objects = context.selected_objects
+        armatures = [obj for obj in objects if obj.type == "ARMATURE"]
+        if len(armatures) == 0:
+            raise RuntimeError("No armature found. ")
+
+        names = []
+        for armature in armatures:
+            name = armature.name
+            if self.name_from == 'COLLECTION' and armature.users_collection:
+                name = armature.users_collection[0].name
+            names.append((name, armature.name))
+        file_names = batch_file_names(names, bpy.path.clean_name)
+        named_armatures = list(zip(file_names, armatures))
+        return named_armatures
+
+    def execute(self, context):
+        from .fbxskel_logging import setup_logging
+        from .fbxskel_writer import export_fbxskel_batch
+        from .fbxskel_timing import timed, profiled
+        setup_logging()
+        addon_prefs = GetAddonPreferences(context)
+        SetLoggingLevel(addon_prefs.logging_level)
+        directory = bpy.path.abspath(self.directory)
+        try:
+            named_armatures = self.named_armatures(context)
+        except Exception as e:
+            self.report({"ERROR"}, "Could not export fbxskel, reason = " + str(e))
+            return {"CANCELLED"}
+
+        with profiled(TakeProfilePath(addon_prefs, "batch_export")), timed("Batch export") as span:
+            results = export_fbxskel_batch(named_armatures, directory)
+            span["armatures"] = len(results)
+
+        failed = 0
+        unchanged = 0
+        beware = False
+        for filepath, written, beware_write, error in results:
+            if error is not None:
+                failed += 1
+                logger.warning("Unable to export " + filepath + ", reason = " + str(error))
+            elif not written:
+                unchanged += 1
+            beware = beware or beware_write
+        message = "Exported " + str(len(results) - failed) + " of " + str(len(results)) + " armature(s) to " + directory + " (" + str(unchanged) + " unchanged)"
+        if failed or beware:
+            logger.warning(message + ", but warning were generated: make sure everything went correctly by checking the system console, found in Window->Toggle System Console")
+            self.report({"WARNING"}, message + ", but warning were generated: check the system console")
+        else:
+            logger.info(message)
+            self.report({"INFO"}, message)
+        return {"FINISHED"}
+
+class FBXSKEL_WatchFbxskel(bpy.types.Operator):
+    """Toggle watch mode: armatures imported from fbxskel files are updated when their file changes on disk"""
+    bl_idname = "fbxskel_import.watch"
+    bl_label = 'Watch WILDS Fbxskel Files'
+
+    def execute(self, context):
+        from .fbxskel_logging import setup_logging
+        from .fbxskel_watch import start_watch, stop_watch, is_watching
+        setup_logging()
+        addon_prefs = GetAddonPreferences(context)
+        SetLoggingLevel(addon_prefs.logging_level)
+        if is_watching():
+            stop_watch()
+            logger.info("Watch mode off")
+            self.report({"INFO"}, "Watch mode off")
+        else:
+            start_watch()
+            logger.info("Watch mode on: imported armatures follow their fbxskel files")
+            self.report({"INFO"}, "Watch mode on")
+        return {"FINISHED"}
@@ -0,0 +1,12 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def pytest_collect_directory(path, parent):
+    # The repository root is the addon package, whose __init__.py needs Blender: collect it as a plain
+    # directory so pytest doesn't import it
+    if str(path) == ROOT:
+        return pytest.Dir.from_parent(parent, path=path)
+    return None
@@ -0,0 +1,21 @@
+import re
+
+from fbxskel.fbxskel_writer import batch_file_names
+
+def clean_name(name):
+    # Like bpy.path.clean_name: anything but letters, digits, "-" and "_" becomes "_"
+    return re.sub(r"[^A-Za-z0-9_\-]", "_", name)
+
+def test_importer_suffixes_are_stripped_before_cleaning():
+    names = [("ch03_000_0000 Armature", "a"), ("ch04_000_0000.fbxskel", "b"), ("ch05_000_0000.fbxskel.7", "c"), ("my rig.v2", "d")]
+    assert batch_file_names(names, clean_name) == ["ch03_000_0000.fbxskel.7", "ch04_000_0000.fbxskel.7", "ch05_000_0000.fbxskel.7", "my_rig_v2.fbxskel.7"]
+
+def test_collisions_never_share_a_file():
+    names = [("body", "Armature"), ("body", "Armature.001"), ("body", "Armature.001"), ("Body", "Armature"), ("body_Armature_001", "x")]
+    file_names = batch_file_names(names, clean_name)
+    assert file_names[0] == "body.fbxskel.7"
+    assert file_names[1] == "body_Armature_001.fbxskel.7"
+    assert len(set(file_name.lower() for file_name in file_names)) == len(names)
+
+def test_without_clean_name():
+    assert batch_file_names([("ch03_000_0000 Armature", "a")]) == ["ch03_000_0000.fbxskel.7"]
@@ -0,0 +1,23 @@
+from fbxskel.fbxskel_diff import diff_skeletons, diff_is_empty
+from fbxskel.fbxskel_writer import write_fbxskel
+from fbxskel.fbxskel_skeleton import Skeleton
+from fbxskel.fbxskel_parser import BONE_DTYPE, HEADER_SIZE
+from fbxskel.fbxskel_bench import make_synthetic_skeleton
+
+def test_broken_stored_hashes_still_match_by_name():
+    data, _ = write_fbxskel(make_synthetic_skeleton(300))
+    broken = bytearray(data)
+    for bone_i in range(300):
+        record = HEADER_SIZE + bone_i * BONE_DTYPE.itemsize
+        broken[record + BONE_DTYPE.fields["name_hash"][1]:record + BONE_DTYPE.fields["name_hash"][1] + 4] = bytes(4)
+        broken[record + BONE_DTYPE.fields["id"][1]:record + BONE_DTYPE.fields["id"][1] + 2] = bytes(2)
+    skeleton = Skeleton.from_bytes(data)
+    other = Skeleton.from_bytes(bytes(broken))
+    assert not other.name_hashes.any()
+    diff = diff_skeletons(skeleton, other)
+    assert diff["added"] == [] and diff["removed"] == [] and diff["renamed"] == []
+    assert len(diff["id_changed"]) == 300 - list(skeleton.ids).count(0)
+
+def test_identical_skeletons():
+    skeleton = Skeleton.from_bytes(write_fbxskel(make_synthetic_skeleton(50))[0])
+    assert diff_is_empty(diff_skeletons(skeleton, skeleton))
@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+import pytest
+
+from fbxskel import fbxskel_hash
+from fbxskel.fbxskel_hash import murmurhash_32, murmurhash_32_batch, hash_bone_names, clear_name_hash_cache
+
+SEEDS = [0, 0xFFFFFFFF, 12345]
+
+def random_keys(count=3000, seed=0):
+    rnd = random.Random(seed)
+    keys = [bytes(rnd.randrange(256) for _ in range(length)) for length in range(71)]
+    keys += [bytes(rnd.randrange(256) for _ in range(rnd.randrange(71))) for _ in range(count - len(keys))]
+    return keys
+
+@pytest.fixture
+def numpy_only(monkeypatch):
+    # Force the NumPy implementation even when mmh3 is installed
+    monkeypatch.setattr(fbxskel_hash, "mmh3", None)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_matches_reference(numpy_only, seed):
+    keys = random_keys()
+    expected = [murmurhash_32(key, seed) for key in keys]
+    assert murmurhash_32_batch(keys, seed).tolist() == expected
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batch_matches_reference_with_mmh3(seed):
+    if fbxskel_hash.mmh3 is None:
+        pytest.skip("mmh3 not installed")
+    keys = random_keys()
+    assert murmurhash_32_batch(keys, seed).tolist() == [murmurhash_32(key, seed) for key in keys]
+
+def test_batch_edge_cases(numpy_only):
+    assert murmurhash_32_batch([], 0xFFFFFFFF).tolist() == []
+    assert murmurhash_32_batch([b""], 0xFFFFFFFF).tolist() == [murmurhash_32(b"", 0xFFFFFFFF)]
+    assert murmurhash_32_batch([b"\xff" * 70], 12345).tolist() == [murmurhash_32(b"\xff" * 70, 12345)]
+
+def test_hash_bone_names(numpy_only):
+    rnd = random.Random(1)
+    alphabet = "abcXYZ_019éü日本"
+    names = ["".join(rnd.choice(alphabet) for _ in range(rnd.randrange(36))) for _ in range(2000)]
+    expected = [murmurhash_32(name.encode("utf-16LE"), 0xFFFFFFFF) for name in names]
+    clear_name_hash_cache()
+    assert np.asarray(hash_bone_names(names)).tolist() == expected
+    # Second call goes through the cache
+    assert np.asarray(hash_bone_names(names)).tolist() == expected
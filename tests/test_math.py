@@ -0,0 +1,22 @@
+import numpy as np
+
+from fbxskel.fbxskel_math import subtree_mask, bone_world_matrices
+from fbxskel.fbxskel_bench import make_synthetic_skeleton
+
+def test_subtree_mask_reaches_all_descendants():
+    # 0 -> 1 -> 2 -> 3, 0 -> 4, children listed before their parents too
+    parents = [-1, 0, 1, 2, 0, 3]
+    mask = subtree_mask(parents, [False, True, False, False, False, False])
+    assert mask.tolist() == [False, True, True, True, False, True]
+
+def test_subtree_mask_covers_every_moved_world_matrix():
+    bone_columns = make_synthetic_skeleton(200)
+    parents = np.asarray(bone_columns["parent_id"])
+    quats = np.asarray(bone_columns["rot"], dtype=np.float64)
+    locs = np.asarray(bone_columns["loc"], dtype=np.float64)
+    moved_locs = locs.copy()
+    moved_locs[[7, 50]] += 1.0
+    changed = np.zeros(len(parents), dtype=bool)
+    changed[[7, 50]] = True
+    world_moved = np.any(np.abs(bone_world_matrices(parents, quats, locs) - bone_world_matrices(parents, quats, moved_locs)) > 1e-6, axis=(1, 2))
+    assert np.array_equal(subtree_mask(parents, changed), world_moved)
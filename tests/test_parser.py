@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from fbxskel.fbxskel_parser import FbxskelParser
+from fbxskel.fbxskel_writer import write_fbxskel
+from fbxskel.fbxskel_bench import make_synthetic_skeleton
+
+@pytest.fixture
+def fbxskel_path(tmp_path):
+    bone_columns = make_synthetic_skeleton(50)
+    data, _ = write_fbxskel(bone_columns)
+    path = tmp_path / "synthetic.fbxskel.7"
+    path.write_bytes(data)
+    return str(path), bone_columns
+
+@pytest.mark.parametrize("positioned", [False, True])
+def test_bone_table_outlives_parser(fbxskel_path, positioned):
+    path, bone_columns = fbxskel_path
+    with FbxskelParser(path=path, positioned=positioned) as parser:
+        bone_table = parser.read_bone_table()
+        hash_table = parser.read_hash_table()
+    assert bone_table["parent"].tolist() == np.asarray(bone_columns["parent_id"]).tolist()
+    assert len(hash_table) == 50
+
+@pytest.mark.parametrize("positioned", [False, True])
+def test_columns_outlive_parser(fbxskel_path, positioned):
+    path, bone_columns = fbxskel_path
+    with FbxskelParser(path=path, positioned=positioned) as parser:
+        columns = parser.read_columns(["parent", "id", "name"], start=10, stop=20)
+    assert columns["parent"].tolist() == np.asarray(bone_columns["parent_id"][10:20]).tolist()
+    assert columns["id"].tolist() == np.asarray(bone_columns["id"][10:20]).tolist()
+    assert columns["name"] == bone_columns["name"][10:20]
+
+def test_read_after_close(fbxskel_path):
+    path, bone_columns = fbxskel_path
+    with FbxskelParser(path=path) as parser:
+        bone_infos = parser.read()
+    assert [bone_info["name"] for bone_info in bone_infos] == bone_columns["name"]
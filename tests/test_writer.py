@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from fbxskel.fbxskel_parser import FbxskelParser, MAX_BONE_COUNT
+from fbxskel.fbxskel_writer import write_fbxskel, patch_fbxskel
+from fbxskel.fbxskel_skeleton import Skeleton
+from fbxskel.fbxskel_bench import make_synthetic_skeleton
+
+def synthetic_columns(bone_count=20):
+    bone_columns = make_synthetic_skeleton(bone_count)
+    bone_columns["id"] = np.array(bone_columns["id"], dtype=np.int64)
+    bone_columns["parent_id"] = np.array(bone_columns["parent_id"], dtype=np.int64)
+    return bone_columns
+
+def test_roundtrip_keeps_parents_and_ids():
+    bone_columns = synthetic_columns()
+    data, _ = write_fbxskel(bone_columns)
+    with FbxskelParser(data=data) as parser:
+        columns = parser.read_columns(["parent", "id"])
+    assert columns["parent"].tolist() == bone_columns["parent_id"].tolist()
+    assert columns["id"].tolist() == bone_columns["id"].tolist()
+
+@pytest.mark.parametrize("column, value", [("id", 70000), ("id", -1), ("parent_id", 20), ("parent_id", -2), ("parent_id", 40000)])
+def test_writer_rejects_values_that_would_wrap(column, value):
+    bone_columns = synthetic_columns()
+    bone_columns[column][5] = value
+    with pytest.raises(RuntimeError):
+        write_fbxskel(bone_columns)
+
+@pytest.mark.parametrize("column, value", [("id", 70000), ("parent_id", 40000)])
+def test_skeleton_rejects_values_that_would_wrap(column, value):
+    bone_columns = synthetic_columns()
+    bone_columns[column][5] = value
+    with pytest.raises(RuntimeError):
+        Skeleton(bone_columns["name"], bone_columns["parent_id"], bone_columns["id"], bone_columns["rot"], bone_columns["loc"], bone_columns["scl"])
+
+def test_too_many_bones():
+    names = ["Bone" + str(index) for index in range(MAX_BONE_COUNT + 1)]
+    bone_columns = {
+        "name": names,
+        "index": np.arange(len(names)),
+        "id": np.zeros(len(names), dtype=np.int64),
+        "parent_id": np.full(len(names), -1, dtype=np.int64),
+        "rot": np.zeros((len(names), 4)),
+        "loc": np.zeros((len(names), 3)),
+        "scl": np.ones((len(names), 3)),
+    }
+    with pytest.raises(RuntimeError):
+        write_fbxskel(bone_columns)
+
+def test_patch_replaces_file_atomically(tmp_path):
+    path = tmp_path / "synthetic.fbxskel.7"
+    data, _ = write_fbxskel(synthetic_columns())
+    path.write_bytes(data)
+    path.chmod(0o640)
+    skeleton = Skeleton.from_file(str(path))
+    skeleton.loc[3] += 1.0
+    skeleton.ids[7] = 1234
+    inode = path.stat().st_ino
+    assert patch_fbxskel(str(path), skeleton) == 2
+    assert path.stat().st_ino != inode
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert [entry.name for entry in tmp_path.iterdir()] == [path.name]
+    assert path.read_bytes() == write_fbxskel(skeleton)[0]
+    assert patch_fbxskel(str(path), skeleton) == 0